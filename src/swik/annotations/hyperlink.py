@@ -46,23 +46,28 @@ class ExternalLink(Link):
 class InternalLink(Link):
     def __init__(self, rect, dest):
         super().__init__(rect)
-        self.dest_page = dest[0]
-        self.x = dest[1]
-        self.y = dest[2]
+        # (page, x, y) or a function that returns it
+        self.dest = dest
         self.setAcceptHoverEvents(True)
 
+    def get_dest(self):
+        if callable(self.dest):
+            self.dest = self.dest()
+        page, x, y = self.dest
+        return page, QPointF(x, y)
+
     def mousePressEvent(self, event: 'QGraphicsSceneMouseEvent') -> None:
         super(Link, self).mousePressEvent(event)
-        self.signals.clicked.emit(self.dest_page, QPointF(self.x, self.y))
+        self.signals.clicked.emit(*self.get_dest())
 
     def hoverMoveEvent(self, event):
         super().hoverMoveEvent(event)
-        self.signals.link_hovered.emit(Link.MOVE, self.dest_page, QPointF(self.x, self.y))
+        self.signals.link_hovered.emit(Link.MOVE, *self.get_dest())
 
     def hoverEnterEvent(self, event):
-        self.signals.link_hovered.emit(Link.ENTER, self.dest_page, QPointF(self.x, self.y))
+        self.signals.link_hovered.emit(Link.ENTER, *self.get_dest())
         self.setCursor(Qt.PointingHandCursor)
 
     def hoverLeaveEvent(self, event):
-        self.signals.link_hovered.emit(Link.LEAVE, self.dest_page, QPointF(self.x, self.y))
+        self.signals.link_hovered.emit(Link.LEAVE, *self.get_dest())
         self.setCursor(Qt.ArrowCursor)
\ No newline at end of file
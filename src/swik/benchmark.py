@@ -0,0 +1,289 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import psutil
+import pymupdf
+from PyQt5.QtCore import QRunnable
+from PyQt5.QtWidgets import QApplication, QMainWindow
+
+import swik.utils as utils
+from swik.renderer import MuPDFRenderer
+from swik.thumbnail_cache import ThumbnailCache
+
+PAGE_COUNTS = [10, 100, 1000, 5000]
+PHASES = ["open", "scroll", "zoom", "search", "rearrange", "crop", "save"]
+ZOOMS = [0.5, 1, 1.5, 2, 3, 1.5]
+SEARCH_TEXT = "needle"
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore "
+         "et dolore magna aliqua ut enim ad minim veniam quis nostrud exercitation ullamco laboris").split()
+
+
+class RenderJob(QRunnable):
+    def __init__(self, renderer, index, ratio):
+        super().__init__()
+        self.renderer = renderer
+        self.index = index
+        self.ratio = ratio
+
+    def run(self):
+        self.renderer.render_page(self.index, self.ratio)
+
+
+def render_all(renderer, ratio):
+    # Every page through the render threads, as the views do
+    pool = renderer.service.pool
+    start = time.perf_counter()
+    for index in range(renderer.get_num_of_pages()):
+        pool.start(RenderJob(renderer, index, ratio))
+    pool.waitForDone()
+    return time.perf_counter() - start
+
+
+def compare_backends(filename, ratio=1.5, repeat=3):
+    renderer = MuPDFRenderer()
+    if renderer.open_pdf(filename) != MuPDFRenderer.OPEN_OK:
+        print("Cannot open", filename)
+        return None
+
+    if renderer.get_num_of_pages() < renderer.processes.MIN_PAGES:
+        print("Warning: documents with less than {} pages are always rendered in threads".format(renderer.processes.MIN_PAGES))
+
+    results = {}
+    for name, backend in [("threads", MuPDFRenderer.BACKEND_THREADS), ("processes", MuPDFRenderer.BACKEND_PROCESSES)]:
+        renderer.set_render_backend(backend)
+
+        # The first pass opens the documents (and starts the processes)
+        warmup = render_all(renderer, ratio)
+        times = [render_all(renderer, ratio) for _ in range(repeat)]
+        results[name] = times
+        print("{:10s} warm-up {:7.3f}s  best {:7.3f}s  mean {:7.3f}s  ({:.1f} pages/s)".format(
+            name, warmup, min(times), sum(times) / len(times), renderer.get_num_of_pages() / min(times)))
+
+    renderer.set_render_backend(MuPDFRenderer.BACKEND_THREADS)
+    return results
+
+
+def generate_pdf(filename, pages):
+    # Text, some vector graphics and the searched word every tenth page
+    doc = pymupdf.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), "Page {}".format(i + 1), fontsize=18)
+        text = " ".join(WORDS[(i + j) % len(WORDS)] for j in range(400))
+        if i % 10 == 0:
+            text = SEARCH_TEXT + " " + text
+        page.insert_textbox(pymupdf.Rect(72, 100, 523, 600), text, fontsize=10)
+        page.draw_rect(pymupdf.Rect(72, 620, 523, 770), color=(0, 0, 0.5), fill=(0.8, 0.9, 1))
+        page.draw_circle((297, 695), 60 + i % 10, color=(0.6, 0, 0))
+    doc.save(filename, garbage=3, deflate=True)
+    doc.close()
+
+
+class Monitor:
+    # Pumps the events of the application as the event loop would,
+    # sampling the RSS of the process to get the peak of each phase
+
+    def __init__(self, app, widget):
+        self.app = app
+        self.widget = widget
+        self.process = psutil.Process()
+        self.peak = 0
+        self.settled = 0
+
+    def sample(self):
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def pump(self):
+        self.app.processEvents()
+        self.sample()
+
+    def is_busy(self):
+        renderer, view = self.widget.renderer, self.widget.view
+        return renderer.is_opening() or len(renderer.service.jobs) > 0 or view.is_interacting() or self.widget.miniature_view.is_interacting()
+
+    def wait_idle(self, settle=0.3, timeout=600):
+        # Until nothing has been rendered for settle seconds (the pages
+        # ask for their images when painted), returns when it got idle
+        last_busy = started = time.perf_counter()
+        while time.perf_counter() - last_busy < settle and time.perf_counter() - started < timeout:
+            self.pump()
+            if self.is_busy():
+                last_busy = time.perf_counter()
+            time.sleep(0.005)
+
+        # Not counted when waiting in the middle of a phase
+        self.settled += time.perf_counter() - last_busy
+        return last_busy
+
+    def run(self, name, action):
+        renderer = self.widget.renderer
+        renderer.metrics.reset()
+        self.peak = 0
+        self.sample()
+
+        started = time.perf_counter()
+        self.settled = 0
+        action()
+        waited = self.settled
+        finished = self.wait_idle() - waited
+
+        summary = renderer.metrics.get_summary()
+        raster = summary["raster"]
+        result = {"time": finished - started, "peak_rss": self.peak, "renders": summary.get("delivered", 0),
+                  "raster": raster["mean"] * raster["count"] if raster is not None else 0,
+                  "cache_hit_rate": summary["cache_hit_rate"]}
+        print("  {:10s} {:8.3f}s  peak {:7.1f} MB  {:6d} renders  raster {:7.3f}s".format(
+            name, result["time"], result["peak_rss"] / 2 ** 20, result["renders"], result["raster"]))
+        return result
+
+
+def run_scenario(app, filename, workdir, crop_pages=5):
+    # Open, scroll through all pages, zoom sweep, search, rearrange,
+    # crop adjustment and save, each phase until the renders are done
+    from swik.swik_config import SwikConfig
+    from swik.swik_widget import SwikWidget
+
+    # The configuration and the thumbnails of the user are not touched
+    config = SwikConfig()
+    config.base_dir = workdir + os.sep
+    window = QMainWindow()
+    widget = SwikWidget(window, config)
+    widget.renderer.thumbnails = ThumbnailCache(os.path.join(workdir, "thumbnails"))
+    window.setCentralWidget(widget)
+    window.resize(1200, 900)
+    window.show()
+
+    monitor = Monitor(app, widget)
+    renderer, view = widget.renderer, widget.view
+    monitor.wait_idle()
+
+    def scroll():
+        bar = view.verticalScrollBar()
+        bar.setValue(0)
+        while bar.value() < bar.maximum():
+            bar.setValue(bar.value() + view.viewport().height())
+            monitor.pump()
+
+    def zoom():
+        for ratio in ZOOMS:
+            view.set_ratio2(ratio)
+            monitor.wait_idle()
+
+    def search():
+        ends = []
+        finder = widget.finder_toolbar.finder
+        finder.progress.connect(lambda percent: percent == 1 and ends.append(percent))
+        widget.finder_toolbar.activated()
+        widget.finder_toolbar.find_edit.setText(SEARCH_TEXT)
+        widget.finder_toolbar.find_text()
+        # Once for the last page and once when finished
+        while len(ends) < 2:
+            monitor.pump()
+            time.sleep(0.005)
+        widget.finder_toolbar.close()
+
+    def rearrange():
+        # As the rearranger tool does
+        order = list(reversed(range(renderer.get_num_of_pages())))
+        renderer.rearrange_pages(order, False)
+        for v in [view, widget.miniature_view]:
+            v.rearrange(order)
+            v.update_layout()
+
+    def crop():
+        # As the crop tool does for the pages with a selection
+        for index in range(min(crop_pages, renderer.get_num_of_pages())):
+            utils.adjust_crop(renderer.render_image(index, 1), 1, 255)
+
+    phases = {"open": lambda: widget.open_file(filename, warn=False),
+              "scroll": scroll, "zoom": zoom, "search": search, "rearrange": rearrange, "crop": crop,
+              "save": lambda: widget.save_file(os.path.join(workdir, "saved.pdf"))}
+
+    results = {name: monitor.run(name, phases[name]) for name in PHASES}
+    widget.die()
+    window.close()
+    return results
+
+
+def run_suite(page_counts, workdir, crop_pages=5):
+    app = QApplication.instance() or QApplication(sys.argv)
+    results = {}
+    for pages in page_counts:
+        filename = os.path.join(workdir, "bench_{}.pdf".format(pages))
+        if not os.path.exists(filename):
+            generate_pdf(filename, pages)
+
+        print("{} pages".format(pages))
+        started = time.perf_counter()
+        results[str(pages)] = run_scenario(app, filename, workdir, crop_pages)
+        results[str(pages)]["total"] = {"time": time.perf_counter() - started}
+
+    # Linux reports kilobytes, macOS bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print("Peak RSS {:.1f} MB".format(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)))
+    return results
+
+
+def compare_baseline(results, baseline, tolerance=0.2):
+    # Phases slower than the baseline by more than tolerance
+    regressions = 0
+    for pages, phases in results.items():
+        for name, result in phases.items():
+            base = baseline.get(pages, {}).get(name)
+            if base is None or base["time"] <= 0:
+                continue
+            change = result["time"] / base["time"] - 1
+            regressed = change > tolerance
+            regressions += regressed
+            print("{:>6s} {:10s} {:8.3f}s  baseline {:8.3f}s  {:+7.1%}{}".format(
+                pages, name, result["time"], base["time"], change, "  REGRESSION" if regressed else ""))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Swik rendering benchmark")
+    parser.add_argument("filename", nargs="?", help="Compare the render backends with this file")
+    parser.add_argument("--ratio", type=float, default=1.5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--suite", action="store_true", help="Run the scenarios on generated documents")
+    parser.add_argument("--pages", type=lambda value: [int(v) for v in value.split(",")], default=PAGE_COUNTS,
+                        help="Comma separated sizes of the generated documents")
+    parser.add_argument("--crop-pages", type=int, default=5)
+    parser.add_argument("--workdir", help="Where the documents are generated (and kept)")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare the results with this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if not args.suite and args.filename is None:
+        parser.error("a filename or --suite is required")
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QApplication(sys.argv)
+
+    if not args.suite:
+        compare_backends(args.filename, args.ratio, args.repeat)
+        return
+
+    workdir = args.workdir if args.workdir is not None else tempfile.mkdtemp(prefix="swik_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    results = run_suite(args.pages, workdir, args.crop_pages)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare_baseline(results, baseline, args.tolerance) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,10 @@ from swik.action import Action
 class ChangesTracker(QObject):
     dirty = pyqtSignal(bool)
 
+    # Changes to the structure of the document, after them the
+    # file is saved in full to drop the objects no longer used
+    STRUCTURAL = [Action.PAGE_ORDER_CHANGED, Action.PAGES_ADDED, Action.PAGES_DUPLICATED]
+
     class Stack(list):
 
         class Signals(QObject):
@@ -44,13 +48,22 @@ class ChangesTracker(QObject):
         self.redo_stack = self.Stack()
         self.undo_stack.signals.dirty.connect(self.dirty.emit)
         self.not_undoable = 0
+        self.structural = False
 
     def add_not_undoable(self):
         self.undo_stack.clear()
         self.redo_stack.clear()
         self.not_undoable += 1
+        self.structural = True
         self.dirty.emit(True)
 
+    def check_structural(self, action):
+        if any(atom.kind in self.STRUCTURAL for atom in action):
+            self.structural = True
+
+    def needs_full_save(self):
+        return self.structural
+
     def is_dirty(self):
         return len(self.undo_stack) > 0 or self.not_undoable > 0
 
@@ -58,6 +71,7 @@ class ChangesTracker(QObject):
         self.undo_stack.clear()
         self.redo_stack.clear()
         self.not_undoable = 0
+        self.structural = False
         self.dirty.emit(False)
 
     def undo(self):
@@ -102,12 +116,15 @@ class ChangesTracker(QObject):
         self.undo_stack.append(action)
 
     def add_action(self, action):
+        self.check_structural(action)
         self.undo_stack.append(action)
 
     def item_changed(self, action):
+        self.check_structural(action)
         self.undo_stack.append(action)
 
     def saved(self):
         self.undo_stack.clear()
         self.redo_stack.clear()
         self.not_undoable = 0
+        self.structural = False
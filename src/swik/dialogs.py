@@ -318,14 +318,14 @@ class EnumerateDialog(QDialog):
         f_layout = QFormLayout()
         self.layout.addLayout(f_layout)
         self.from_cb = QComboBox()
-        self.from_cb.addItems(str(i) for i in range(1, len(self.view.pages) + 1))
+        self.from_cb.addItems(str(i) for i in range(1, self.view.get_num_of_pages() + 1))
         self.from_cb.currentIndexChanged.connect(self.from_changed)
 
         self.to_cb = QComboBox()
         self.from_changed(0)
 
         self.first_page = QComboBox()
-        self.first_page.addItems(str(i) for i in range(1, len(self.view.pages) + 1))
+        self.first_page.addItems(str(i) for i in range(1, self.view.get_num_of_pages() + 1))
 
         self.text_te = QLineEdit("$i")
         self.text_te.setAlignment(Qt.AlignCenter)
@@ -371,7 +371,7 @@ class EnumerateDialog(QDialog):
 
     def from_changed(self, index):
         self.to_cb.clear()
-        self.to_cb.addItems(str(i) for i in range(index + 1, len(self.view.pages) + 1))
+        self.to_cb.addItems(str(i) for i in range(index + 1, self.view.get_num_of_pages() + 1))
         self.to_cb.setCurrentIndex(self.to_cb.count() - 1)
 
 
@@ -0,0 +1,197 @@
+import atexit
+import os
+import tempfile
+import threading
+import traceback
+from collections import OrderedDict
+
+import pymupdf
+from pymupdf import mupdf
+from pymupdf.mupdf import PDF_ENCRYPT_KEEP
+
+
+def run_annotations(page, device):
+    # Annotations and widgets, without the content of the page
+    mupdf.fz_run_page_annots(page.this, device, mupdf.FzMatrix(), mupdf.FzCookie())
+    mupdf.fz_run_page_widgets(page.this, device, mupdf.FzMatrix(), mupdf.FzCookie())
+    mupdf.fz_close_device(device)
+
+
+def get_annotations_bbox(page):
+    bbox = mupdf.FzRect(mupdf.FzRect.Fixed_EMPTY)
+    run_annotations(page, mupdf.fz_new_bbox_device(bbox))
+    return pymupdf.Rect(bbox)
+
+
+def create_display_list(page, layer):
+    if layer == DocumentPool.LAYER_ANNOTATIONS:
+        display_list = mupdf.FzDisplayList(mupdf.fz_bound_page(page.this))
+        run_annotations(page, mupdf.fz_new_list_device(display_list))
+        return pymupdf.DisplayList(display_list)
+    return page.get_displaylist(annots=layer == DocumentPool.LAYER_ALL)
+
+
+class DocumentPool:
+    # MuPDF documents cannot be shared between threads, so each rendering
+    # thread opens its own copy of the document from the file it was read
+    # from (or a temporary file, of a copy or a snapshot, see reset) and finds
+    # the pages there by the xref of their page object, which does not
+    # change when the pages are rearranged. The pages edited or added
+    # since then are not in the file as they are shown: their display
+    # lists are made by the thread that owns the document and handed
+    # over with the render request. The display lists are shared by all
+    # the threads, so zooming and tiling do not interpret the page again
+
+    DISPLAY_LISTS = 32
+
+    # What the display lists of a page contain
+    LAYER_ALL = 0
+    LAYER_CONTENT = 1
+    LAYER_ANNOTATIONS = 2
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.revision = 0
+        self.filename = None
+        self.password = None
+        self.snapshot = None
+        self.xref_length = 0
+        self.edited = set()
+        self.indices = None
+        self.display_lists = OrderedDict()
+        self.edited_lists = OrderedDict()
+        atexit.register(self.remove_snapshot)
+
+    def reset(self, document, filename=None, password=None, snapshot=False):
+        # The document as read from the file, without filename if it is
+        # not: then it is written, once, to a snapshot read instead (all
+        # the pages made by the thread that owns it if that fails). A
+        # snapshot is a temporary file removed once replaced
+        if filename is None:
+            filename = self.write_snapshot(document)
+            snapshot = filename is not None
+
+        with self.lock:
+            if filename != self.snapshot:
+                self.remove_snapshot()
+            self.filename = filename
+            self.password = password
+            self.snapshot = filename if snapshot else None
+
+            # Objects created later are numbered after these
+            self.xref_length = document.xref_length() if filename is not None else 0
+            self.edited.clear()
+            self.indices = None
+            self.revision += 1
+        self.edited_lists.clear()
+
+    def detach(self):
+        # Nobody opens the file until reset (see MuPDFRenderer.save_pdf)
+        with self.lock:
+            self.filename = None
+            self.revision += 1
+        self.edited_lists.clear()
+
+    def edit(self, page_id):
+        self.edited.add(page_id)
+        for key in [key for key in self.edited_lists if key[0] == page_id]:
+            self.edited_lists.pop(key)
+
+    def is_edited(self, page_id):
+        return self.filename is None or page_id >= self.xref_length or page_id in self.edited
+
+    def get_edited_display_list(self, document, index, page_id, version, layer):
+        # Called from the thread that owns the document, None
+        # for the pages the render threads find in the file
+        if not self.is_edited(page_id):
+            return None
+
+        key = page_id, version, layer
+        display_list = self.edited_lists.get(key)
+        if display_list is not None:
+            self.edited_lists.move_to_end(key)
+            return display_list
+
+        display_list = self.edited_lists[key] = create_display_list(document[index], layer)
+        while len(self.edited_lists) > self.DISPLAY_LISTS:
+            self.edited_lists.popitem(last=False)
+        return display_list
+
+    @staticmethod
+    def write_snapshot(document):
+        # Not garbage collected: the objects keep their numbers, and
+        # the pages are found there by the xrefs of the document
+        fd, filename = tempfile.mkstemp(prefix="swik_", suffix=".pdf")
+        os.close(fd)
+        try:
+            document.save(filename, encryption=PDF_ENCRYPT_KEEP)
+            return filename
+        except Exception:
+            traceback.print_exc()
+            os.remove(filename)
+            return None
+
+    def remove_snapshot(self):
+        # Threads that already opened it keep working
+        if self.snapshot is not None:
+            try:
+                os.remove(self.snapshot)
+            except OSError:
+                pass
+            self.snapshot = None
+
+    def get_revision(self):
+        return self.revision
+
+    def get_source(self):
+        with self.lock:
+            return self.filename, self.password, self.revision
+
+    def get_document(self):
+        local = self.local
+        if getattr(local, "revision", None) != self.revision:
+            if getattr(local, "document", None) is not None:
+                local.document.close()
+                local.document = None
+
+            # Opened with the lock held so that the
+            # snapshot is not removed in the meantime
+            with self.lock:
+                if self.filename is None:
+                    raise RuntimeError("The document is not rendered from a file")
+                document = pymupdf.open(self.filename)
+                if document.needs_pass and self.password is not None:
+                    document.authenticate(self.password)
+                local.document, local.revision = document, self.revision
+
+        return local.document
+
+    def get_index(self, page_id):
+        # Where the page is in the file
+        document = self.get_document()
+        with self.lock:
+            if self.indices is None or self.indices[0] != self.local.revision:
+                self.indices = self.local.revision, {document.page_xref(i): i for i in range(len(document))}
+            return self.indices[1][page_id]
+
+    def get_display_list(self, index, layer=LAYER_ALL):
+        # Within a revision the copies are identical,
+        # and so the index identifies the page
+        document = self.get_document()
+        key = self.local.revision, index, layer
+        with self.lock:
+            display_list = self.display_lists.get(key)
+            if display_list is not None:
+                self.display_lists.move_to_end(key)
+                return display_list
+
+        display_list = create_display_list(document[index], layer)
+
+        with self.lock:
+            for old in [old for old in self.display_lists if old[0] != self.revision]:
+                self.display_lists.pop(old)
+            self.display_lists[key] = display_list
+            while len(self.display_lists) > self.DISPLAY_LISTS:
+                self.display_lists.popitem(last=False)
+        return display_list
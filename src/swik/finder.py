@@ -3,7 +3,6 @@ import threading
 import time
 
 from PyQt5.QtCore import pyqtSignal, QObject
-from PyQt5.QtWidgets import QGraphicsRectItem
 
 
 class Finder(QObject):
@@ -13,7 +12,7 @@ class Finder(QObject):
     MODE_Cc_W = 3
 
     found = pyqtSignal(int, list)
-    words_needed = pyqtSignal(QGraphicsRectItem)
+    words_needed = pyqtSignal(int)
     progress = pyqtSignal(float)
 
     def __init__(self, view, renderer):
@@ -82,17 +81,17 @@ class Finder(QObject):
 
                 i = (first_page + jk) % self.view.get_num_of_pages()
 
-                page = self.view.get_page_item(i)
                 self.progress.emit((jk + 1) / (self.view.get_num_of_pages()))
 
-                # This must be done with a signal
-                # because the words must be created
-                # in the main thread
-                if not page.has_words():
-                    self.words_needed.emit(page)
+                # This must be done with a signal because the
+                # words (and the page, if it is not an item
+                # yet) must be created in the main thread
+                page = self.view.pages.get(i)
+                if page is None or not page.has_words():
+                    self.words_needed.emit(i)
 
                 # Wait until the page is ready
-                while not page.has_words():
+                while (page := self.view.pages.get(i)) is None or not page.has_words():
                     time.sleep(0.1)
 
                 # Check if the word is in the page
@@ -118,8 +117,8 @@ class Finder(QObject):
                         self.found.emit(len(self.confirmed), sentence)
             self.progress.emit(1)
 
-    def page_gather_words(self, page):
-        page.gather_words()
+    def page_gather_words(self, index):
+        self.view.get_page_item(index).gather_words()
 
     def next(self, direction):
         if len(self.confirmed) > 0:
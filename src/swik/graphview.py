@@ -5,6 +5,9 @@ from PyQt5.QtCore import pyqtSignal, QCoreApplication, Qt, QEvent, QPoint, QTime
 from PyQt5.QtGui import QWheelEvent, QPainter, QColor, QKeyEvent
 from PyQt5.QtWidgets import QGraphicsView, QGraphicsRectItem, QApplication, QScrollBar, QGraphicsEllipseItem
 from swik.miniature_page import MiniaturePage
+from swik.page_layout import PageLayout
+from swik.prefetcher import Prefetcher
+from swik.quality_governor import QualityGovernor
 
 from swik import utils
 from swik.annotations.hyperlink import InternalLink
@@ -36,6 +39,13 @@ class GraphView(QGraphicsView):
     ratio_max = 5
     ratio_min = 0.25
 
+    # Only the pages around the viewport are items of the scene, the
+    # rest are just their geometry. Those further than PAGES_MARGIN
+    # pages from the visible ones are released when there are more
+    # than MAX_PAGES, if they hold nothing that would be lost
+    PAGES_MARGIN = 8
+    MAX_PAGES = 48
+
     # ## Signals
     mouseEvent = pyqtSignal(QEvent)
     page_changed = pyqtSignal(int, int)
@@ -73,6 +83,9 @@ class GraphView(QGraphicsView):
         self.manager = manager
         self.page = 0
         self.pages = SyncDict()
+        self.page_layout = PageLayout(self)
+        self.original_info = {}
+        self.visible_pages = []
         self.immediate_resize = False
         self.page_sep = page_sep
 
@@ -90,8 +103,6 @@ class GraphView(QGraphicsView):
 
         # Mode and alignment
         self.mode = mode
-        self.scene_width, self.scene_height = 0, 0
-        self.max_width, self.max_height = 0, 0
         self.scene().setSceneRect(QRectF())
         self.align = align
 
@@ -99,6 +110,10 @@ class GraphView(QGraphicsView):
         self.timer.setSingleShot(True)
         self.timer.timeout.connect(self.delayed_resize)
 
+        self.prefetcher = Prefetcher(self)
+        self.governor = QualityGovernor(self)
+        self.governor.idle.connect(self.viewport().update)
+
     def finish(self):
         self.pages.clear()
 
@@ -140,7 +155,7 @@ class GraphView(QGraphicsView):
     def get_ratio(self):
         return self.ratio
 
-    def set_mode2(self, mode, ratio=None):
+    def set_mode2(self, mode, ratio=None, scroll=None):
 
         if mode not in [self.MODE_FIT_WIDTH, self.MODE_FIT_PAGE]:
             if ratio is not None:
@@ -154,6 +169,16 @@ class GraphView(QGraphicsView):
             self.ratio_changed.emit(-2)
 
         self.mode = mode
+
+        # Where to be before the pages are shown (e.g. a
+        # document reopened), the page in single page mode
+        if scroll is not None:
+            self.reset()
+            if mode == self.MODE_SINGLE_PAGE:
+                self.page = scroll
+            else:
+                self.set_scroll_value(scroll)
+
         self.fully_update_layout()
 
         if mode == self.MODE_FIT_PAGE:
@@ -194,6 +219,7 @@ class GraphView(QGraphicsView):
             self.horizontalScrollBar().setValue(int(self.horizontalScrollBar().maximum() / 2))
         else:
             self.horizontalScrollBar().setValue(int(self.scene().width() * percent))
+        self.page_scrolled()
 
         # Avoid visual artifacts
         self.scene().setBackgroundBrush(Qt.gray)
@@ -210,13 +236,55 @@ class GraphView(QGraphicsView):
 
     def clear(self):
         self.pages.clear()
+        self.page_layout.clear()
+        self.original_info = {}
         self.scene().clear()
 
     def create_page(self, i, ratio):
         self.pages[i] = self.page_object(i, self, self.manager, self.renderer, ratio)
+        self.pages[i].set_own_items()
         self.scene().addItem(self.pages[i])
         return self.pages[i]
 
+    def get_original_info(self, index):
+        # Where the page comes from, kept by index since
+        # the items are released and created again
+        info = self.original_info.get(index)
+        if info is None:
+            info = self.original_info[index] = {"page": index}
+        return info
+
+    def update_original_info(self, index, info):
+        self.get_original_info(index).update(info)
+
+    def move_original_info(self, order):
+        # Where each page comes from, None for the new ones
+        self.original_info = {i: {"page": "+"} if source is None else dict(self.get_original_info(source))
+                              for i, source in enumerate(order)}
+
+    def release_page(self, index):
+        page = self.pages.pop(index)
+        page.release()
+        self.scene().removeItem(page)
+
+    def can_release_pages(self):
+        return True
+
+    def update_pages(self, visible):
+        # Creates the pages around the visible ones and releases
+        # the ones far from them (see PAGES_MARGIN and MAX_PAGES)
+        if len(visible) == 0:
+            return
+
+        first, last = min(visible) - self.PAGES_MARGIN, max(visible) + self.PAGES_MARGIN
+        for index in range(max(first, 0), min(last + 1, self.get_num_of_pages())):
+            self.get_page_item(index)
+
+        if len(self.pages) > self.MAX_PAGES and self.can_release_pages():
+            for index, page in self.pages.items():
+                if (index < first - self.PAGES_MARGIN or index > last + self.PAGES_MARGIN) and page.is_disposable():
+                    self.release_page(index)
+
     def get_page(self):
         return self.page
 
@@ -233,30 +301,51 @@ class GraphView(QGraphicsView):
             self.horizontalScrollBar().setValue(value)
 
     def get_num_of_pages(self):
-        return len(self.pages)
+        return len(self.page_layout)
 
     def get_page_count(self):
         return self.renderer.get_num_of_pages()
 
+    def get_pages_in_rect(self, rect):
+        # Indices of the pages that intersect rect (scene coordinates)
+        if self.mode == self.MODE_SINGLE_PAGE:
+            return [self.page] if self.page < len(self.page_layout) and self.page_layout.get_rect(self.page).intersects(rect) else []
+        return self.page_layout.get_pages_in_rect(rect)
+
+    def get_viewport_rect(self):
+        return self.mapToScene(self.viewport().rect()).boundingRect()
+
     def page_scrolled(self):
         max_area = 0
-        for i, p in self.pages.items():  # type: SimplePage
-            area, isec = p.visible_area()
+        viewport = self.get_viewport_rect()
+        visible = self.get_pages_in_rect(viewport)
+        for i in visible:
+            # In points, the pages may have different scale
+            rect = self.page_layout.get_rect(i)
+            scale = rect.width() / self.page_layout.get_size(i)[0]
+            isec = rect.intersected(viewport)
+            area = isec.width() * isec.height() / (scale * scale)
             if area > max_area:
                 max_area = area
                 self.page = i
-            if max_area > 0 and area == 0:
-                break
-            # if p.isShown():
-            #    self.page = i
-            #    break
+        self.visible_pages = visible
+        self.update_pages(visible)
+        for i in visible:
+            self.pages[i].read_items()
+        self.renderer.set_visible_pages(self, visible)
         self.page_changed.emit(self.page, self.renderer.get_num_of_pages())
 
     def get_current_page(self):
         return self.pages.get(self.page)
 
+    def is_interacting(self):
+        return self.governor.is_interacting()
+
+    def get_visible_pages(self):
+        return self.visible_pages
+
     def move_to_page(self, index, offset=None):
-        if (page := self.pages.get(index)) is not None:
+        if (page := self.get_page_item(index)) is not None:
             offset = -10 if offset is None else offset
 
             self.page = index
@@ -265,6 +354,7 @@ class GraphView(QGraphicsView):
                 for p in self.pages.values():
                     p.setVisible(False)
                 self.apply_layout(page)
+                self.prefetcher.page_changed(index)
 
             # Must be here because of the fit_width that changes the scrollbars
             if self.get_mode() in [self.MODE_VERTICAL_MULTIPAGE, self.MODE_VERTICAL, self.MODE_FIT_WIDTH,
@@ -279,7 +369,9 @@ class GraphView(QGraphicsView):
     def page_updated(self, index):
         print("page updated on", self)
 
-        self.pages[index].invalidate()
+        if (page := self.pages.get(index)) is not None:
+            page.invalidate()
+        self.update_page_size(index)
         v, h = self.verticalScrollBar().value(), self.horizontalScrollBar().value()
 
         QApplication.processEvents()
@@ -342,6 +434,9 @@ class GraphView(QGraphicsView):
     # ## REIMPLEMENTED METHODS
     def scrollContentsBy(self, dx: int, dy: int) -> None:
         super().scrollContentsBy(dx, dy)
+        # Contents move up when scrolling down
+        self.prefetcher.scrolled(-dy if self.is_vertical() else -dx)
+        self.governor.moved()
         try:
             self.page_scrolled()
         except Exception as e:
@@ -370,13 +465,20 @@ class GraphView(QGraphicsView):
             delta = int((event.angleDelta().y() / 1200) * 100) / 100
             mouse_on_scene = self.mapToScene(event.pos())
             page = self.get_items_at_pos(event.pos(), SimplePage, 0, False)
+            self.governor.moved()
             self.update_ratio(delta)
 
         index = self.page
         page = self.pages.get(index)
 
     def get_page_item(self, index):
-        return self.pages[index]
+        # Created when needed (see update_pages)
+        page = self.pages.get(index)
+        if page is None and 0 <= index < self.get_num_of_pages():
+            page = self.create_page(index, self.ratio)
+            self.apply_layout(page)
+            self.page_created.emit(page)
+        return page
 
     # ## SLOTS
 
@@ -420,14 +522,27 @@ class GraphView(QGraphicsView):
                 self.prev_pos = page.index
                 self.current_pos = page.index
 
-        buffer = []
+        # Only the pages that are items, the others
+        # are created in their new place when shown
+        buffer = {}
 
-        for page in self.pages.values():
-            buffer.append(Element(page))
+        for index, page in self.pages.items():
+            buffer[index] = Element(page)
         self.pages.clear()
+        self.page_layout.rearrange(indices)
+
+        # The copies of a page are new
+        order, seen = [], set()
+        for index in indices:
+            order.append(None if index in seen else index)
+            seen.add(index)
+        self.move_original_info(order)
 
+        duplicated = []
         for i in range(len(indices)):
-            elem = buffer[indices[i]]
+            elem = buffer.get(indices[i])
+            if elem is None:
+                continue
             if elem.count == 0:
                 # print("page", i, "copy")
                 self.pages[i] = elem.page
@@ -440,37 +555,39 @@ class GraphView(QGraphicsView):
             else:
                 # Going to duplicate the page
                 # print("page", i, "create")
-                page = self.page_object(i, self, self.manager, self.renderer, self.ratio)
-                page.update_original_info({"page": "+"})
-                self.pages[i] = page
-                self.scene().addItem(page)
-                page.shine(QColor(255, 0, 0, 100))
+                duplicated.append(i)
 
             elem.current_pos = i
             elem.count += 1
 
-        for elem in buffer:
+        for elem in buffer.values():
             if elem.count == 0:
+                elem.page.release()
                 self.scene().removeItem(elem.page)
             elif elem.current_pos != elem.prev_pos:
                 elem.page.invalidate()
 
-    def insert_page(self, index):
-        pages = {}
-        for i in range(len(self.pages) + 1):
-            if i < index:
-                pages[i] = self.pages[i]
-            elif i == index:
-                pages[i] = self.page_object(index, self, self.manager, self.renderer, self.get_ratio())
-                pages[i].update_original_info({"page": "+"})
-                self.scene().addItem(pages[i])
-                pages[i].shine(QColor(255, 0, 0, 100))
-            else:
-                pages[i] = self.pages[i - 1]
-                pages[i].index = i
+        # Once the pages are in their new place
+        self.place_pages()
+        for i in duplicated:
+            self.get_page_item(i).shine(QColor(255, 0, 0, 100))
 
+    def insert_page(self, index):
+        self.page_layout.insert(index, self.renderer.get_page_size(index))
+        pages = SyncDict()
+        for i, page in self.pages.items():
+            if i >= index:
+                page.index = i + 1
+            pages[page.index] = page
         self.pages = pages
-        return self.pages[index]
+
+        count = self.renderer.get_num_of_pages()
+        self.move_original_info(list(range(index)) + [None] + list(range(index, count - 1)))
+
+        self.place_pages()
+        page = self.get_page_item(index)
+        page.shine(QColor(255, 0, 0, 100))
+        return page
 
     # Mode and ratio
     def is_vertical(self):
@@ -492,156 +609,83 @@ class GraphView(QGraphicsView):
     #
     #     self.set_mode(mode, force)
 
-    def fully_update_layout(self):
+    def place_pages(self):
+        # The layout computed again before new items are placed
         self.reset()
-        for i in range(self.renderer.get_num_of_pages()):
-            if (p := self.pages.get(i)) is not None:
-                self.apply_layout(p)
+        for p in self.pages.values():
+            self.apply_layout(p)
+
+    def fully_update_layout(self):
+        self.place_pages()
+        self.page_scrolled()
         self.update()
         QApplication.processEvents()
 
     def reset(self):
-        if self.mode != self.MODE_SINGLE_PAGE:
-            self.scene_width, self.scene_height = 0, 0
-            self.max_width, self.max_height = self.renderer.get_max_pages_size()
-            rect = self.compute_scene_rect()
-            self.update_scene_rect(rect)
+        # Sizes of the pages not known yet (new or appended)
+        count = self.renderer.get_num_of_pages()
+        if len(self.page_layout) < count:
+            self.page_layout.append([self.renderer.get_page_size(i) for i in range(len(self.page_layout), count)])
+        elif len(self.page_layout) > count:
+            self.page_layout.set_sizes([self.renderer.get_page_size(i) for i in range(count)])
+
+        # Also if computed meanwhile, when a rect was asked for
+        changed = self.page_layout.update()
+        if self.mode != self.MODE_SINGLE_PAGE and (changed or self.scene().sceneRect() != self.page_layout.get_scene_rect()):
+            self.update_scene_rect(self.page_layout.get_scene_rect())
+
+    def update_page_size(self, index):
+        # After a rotation or a crop, only the
+        # pages from index on are placed again
+        if index < len(self.page_layout):
+            self.page_layout.set_size(index, self.renderer.get_page_size(index))
+
+    def update_page_sizes(self):
+        # The sizes known after the document was shown (see
+        # DocumentLoader), the current page stays in its place
+        for index in range(len(self.page_layout)):
+            self.update_page_size(index)
+        if self.page_layout.dirty is None:
+            return
+
+        for page in self.pages.values():
+            if page.get_orig_size() != self.renderer.get_page_size(page.index):
+                page.invalidate()
+
+        index, offset = self.page, None
+        if (page := self.pages.get(index)) is not None:
+            if self.get_mode() in [self.MODE_VERTICAL_MULTIPAGE, self.MODE_VERTICAL, self.MODE_FIT_WIDTH,
+                                   self.MODE_FIT_PAGE]:
+                offset = (self.verticalScrollBar().value() - page.pos().y()) / self.get_ratio()
+            else:
+                offset = (self.horizontalScrollBar().value() - page.pos().x()) / self.get_ratio()
+
+        self.fully_update_layout()
+        if offset is not None:
+            self.move_to_page(index, offset)
 
     def update_scene_rect(self, rect):
         self.scene().setSceneRect(rect)
         self.setAlignment(Qt.AlignBottom | Qt.AlignRight)
         self.setAlignment(self.align)
 
-    def compute_scene_rect(self, page=None):
-        if self.mode == self.MODE_SINGLE_PAGE:
-            w, h = self.renderer.get_page_size(page.index)
-            w = w * self.ratio
-            h = h * self.ratio
-            return QRectF(0, 0, w, h + 40)
-
-        elif self.mode == self.MODE_FIT_WIDTH:
-            max_width, max_height = 0, 20
-            for index in range(self.renderer.get_num_of_pages()):
-                w, h = self.renderer.get_page_size(index)
-                ratio = 1 / (w / (self.viewport().width() - 20))
-                w = w * ratio
-                h = h * ratio
-                max_width = max(max_width, w)
-                max_height = max_height + h + self.page_sep
-            return QRectF(0, 0, max_width, max_height)
-
-        elif self.mode == self.MODE_FIT_PAGE:
-            max_width, max_height = 0, 20
-            for index in range(self.renderer.get_num_of_pages()):
-                w, h = self.renderer.get_page_size(index)
-                ratio = 1 / (h / (self.viewport().height() - 17))
-                w = w * ratio
-                h = h * ratio
-                max_width = max(max_width, w)
-                max_height = max_height + h + self.page_sep
-            return QRectF(0, 0, max_width, max_height)
-        elif self.mode == self.MODE_HORIZONTAL:
-            max_width, max_height = 0, 20
-            for index in range(self.renderer.get_num_of_pages()):
-                w, h = self.renderer.get_page_size(index)
-                w = w * self.ratio
-                h = h * self.ratio
-                max_width = max_width + w + self.page_sep
-                max_height = max(max_height, h)
-            return QRectF(0, 0, max_width, max_height)
-        else:
-            print("here", self.ratio, self.renderer.get_num_of_pages())
-            max_width, max_height = 0, 20
-            for index in range(self.renderer.get_num_of_pages()):
-                w, h = self.renderer.get_page_size(index)
-                w = w * self.ratio
-                h = h * self.ratio
-                max_width = max(max_width, w)
-                max_height = max_height + h + self.page_sep
-            print("res", max_width, max_height)
-            return QRectF(0, 0, max_width, max_height)
-
-    def single_row(self, page):
-        x_pos = 20 if page.index == 0 else self.pages[page.index - 1].pos().x() + self.pages[
-            page.index - 1].get_scaled_width() + self.page_sep
-        self.scene_width = max(self.scene_width, x_pos + page.get_scaled_width() + self.page_sep)
-        self.scene().setSceneRect(0, 0, self.scene_width, self.max_height * page.get_scaling_ratio())
-        page.setPos(x_pos, self.max_height * page.get_scaling_ratio() / 2 - page.get_scaled_height() / 2)
-
-    def single_column_fit_width(self, page):
-        ratio = page.get_orig_width() / (self.viewport().width() - 17)
-        page.update_ratio(1 / ratio)
-        y_pos = 20 if page.index == 0 else self.pages[page.index - 1].pos().y() + self.pages[
-            page.index - 1].get_scaled_height() + self.page_sep
-        self.scene_height = max(self.scene_height, y_pos + page.get_scaled_height() + self.page_sep)
-        page.setPos(0, y_pos)
-        page.setVisible(True)
-
-    def single_column_fit_page(self, page):
-        w, h = page.get_orig_width(), page.get_orig_height()
-        ratio = (h / (self.viewport().height() - 17))
-        page.update_ratio(1 / ratio)
-        y_pos = 20 if page.index == 0 else self.pages[page.index - 1].pos().y() + self.pages[
-            page.index - 1].get_scaled_height() + self.page_sep
-        self.scene_height = max(self.scene_height, y_pos + page.get_scaled_height() + self.page_sep)
-        # self.scene().setSceneRect(0, 0, page.get_scaled_width(), self.scene_height)
-        print("scene_width", self.scene_width, page.get_scaled_width())
-        page.setPos(self.scene().sceneRect().width() / 2 - page.get_scaled_width() / 2, y_pos)
-        page.setVisible(True)
-
-    def single_column(self, page):
-        y_pos = 20 if page.index == 0 else self.pages[page.index - 1].pos().y() + self.pages[
-            page.index - 1].get_scaled_height() + self.page_sep
-        self.scene_height = max(self.scene_height, y_pos + page.get_scaled_height() + self.page_sep)
-        # self.scene().setSceneRect(0, 0, self.max_width * page.get_scaling_ratio(), self.scene_height)
-
-        sw, sh = self.scene().sceneRect().width(), self.scene().sceneRect().height()
-        pw = page.get_scaled_width()
-
-        page.setPos(sw / 2 - pw / 2, y_pos)
-        page.setVisible(True)
-
-    def vertical_multipage(self, page):
-        page.setVisible(True)
-        s_max_width, s_max_height = self.max_width * page.get_scaling_ratio(), self.max_height * page.get_scaling_ratio()
-        max_num_horiz_pages = max(self.viewport().width() // (s_max_width + 2 * self.page_sep), 1)
-        num_cols = min(self.renderer.get_num_of_pages(), max_num_horiz_pages)
-
-        if num_cols == 1:
-            self.single_column(page)
-        else:
-            row = page.index // max_num_horiz_pages
-            col = page.index % max_num_horiz_pages
-            dx = (s_max_width - page.get_scaled_width()) / 2
-            x = self.page_sep + col * (s_max_width + self.page_sep) + dx
-            dy = (s_max_height - page.get_scaled_height()) / 2
-            y = row * (s_max_height + self.page_sep) + dy
-            page.setPos(x, self.page_sep + y)
-            self.scene_height = max(self.scene_height, y + page.get_scaled_height() + self.page_sep)
-            self.scene_width = max(self.scene_width, x + page.get_scaled_width() + self.page_sep)
-            self.scene().setSceneRect(0, 0, self.scene_width, self.scene_height + self.page_sep)
-
     def apply_layout(self, page):
+        if page.index >= len(self.page_layout):
+            return
 
+        rect = self.page_layout.get_rect(page.index)
         if self.mode == self.MODE_SINGLE_PAGE:
             if page.index == self.get_page():
-                rect = self.compute_scene_rect(page)
-                self.update_scene_rect(rect)
+                self.update_scene_rect(QRectF(0, 0, rect.width(), rect.height() + 40))
                 page.setPos(0, 20)
                 page.setVisible(True)
             else:
                 page.setVisible(False)
-
-        elif self.mode == self.MODE_FIT_WIDTH:
-            self.single_column_fit_width(page)
-        elif self.mode == self.MODE_FIT_PAGE:
-            self.single_column_fit_page(page)
-        elif self.mode == self.MODE_VERTICAL_MULTIPAGE:
-            self.vertical_multipage(page)
-        elif self.mode == self.MODE_VERTICAL:
-            self.single_column(page)
-        elif self.mode == self.MODE_HORIZONTAL:
-            self.single_row(page)
+        else:
+            if self.mode in [self.MODE_FIT_WIDTH, self.MODE_FIT_PAGE]:
+                page.update_ratio(rect.width() / page.get_orig_width())
+            page.setPos(rect.topLeft())
+            page.setVisible(True)
 
         if type(page) == MiniaturePage:
             page.number.setPlainText(str(page.index + 1))
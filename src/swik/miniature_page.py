@@ -2,10 +2,15 @@ from PyQt5.QtCore import QRectF
 from PyQt5.QtGui import QBrush, QColor
 from PyQt5.QtWidgets import QGraphicsRectItem, QGraphicsItem, QGraphicsTextItem
 
+from swik.render_service import RenderRequest
 from swik.simplepage import SimplePage
 
 
 class MiniaturePage(SimplePage):
+    RENDER_PRIORITY = RenderRequest.PRIORITY_MINIATURE
+    GRAYSCALE = True
+    THUMBNAILS = True
+
     def __init__(self, index, view, manager, renderer, ratio):
         super().__init__(index, view, manager, renderer, ratio)
         self.background = QGraphicsRectItem(self)
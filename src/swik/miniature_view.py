@@ -12,17 +12,26 @@ class MiniatureView(GraphView):
         super(MiniatureView, self).__init__(manager, renderer, scene,
                                             page=MiniaturePage, mode=GraphView.MODE_FIT_WIDTH,
                                             align=QtCore.Qt.AlignTop | QtCore.Qt.AlignHCenter, page_sep=60)
+        self.highlighted = None
 
     def wheelEvent(self, event: 'QGraphicsSceneWheelEvent') -> None:
         super(QGraphicsView, self).wheelEvent(event)
 
+    def create_page(self, i, ratio):
+        page = super().create_page(i, ratio)
+        if i == self.highlighted:
+            page.set_highlighted(True)
+        return page
+
     def set_page(self, index):
         self.clear_selection()
-        if self.pages.get(index) is not None:
-            self.pages[index].set_highlighted(True)
-            self.centerOn(self.pages[index])
+        if (page := self.get_page_item(index)) is not None:
+            page.set_highlighted(True)
+            self.highlighted = index
+            self.centerOn(page)
 
     def clear_selection(self):
+        self.highlighted = None
         for p in self.pages.values():
             p.set_highlighted(False)
 
@@ -37,3 +46,4 @@ class MiniatureView(GraphView):
             if page is not None:
                 self.page_clicked.emit(page.index)
                 page.set_highlighted(True)
+                self.highlighted = page.index
@@ -23,10 +23,8 @@ class Page(SimplePage):
         self.info.setFont(font)
         self.info.setVisible(False)
         self.info.setFlag(QGraphicsItem.ItemIgnoresTransformations)
-
-        self.read_widgets()
-        self.read_annotations()
-        self.read_links()
+        self.holds_document = False
+        self.items_read = False
 
     def set_visual_info(self, text, color=Qt.black):
         self.info.setPlainText(text)
@@ -36,13 +34,23 @@ class Page(SimplePage):
     def show_visual_info(self, value):
         self.info.setVisible(value)
 
+    def read_items(self):
+        # The first time the page is shown, not when created
+        if not self.items_read:
+            self.items_read = True
+            self.read_widgets()
+            self.read_annotations()
+            self.read_links()
+
     def read_annotations(self):
         annotations = self.renderer.get_annotations(self.index)
         for annotation in annotations:
             annotation.setParentItem(self)
+        self.holds_document = self.holds_document or len(annotations) > 0
 
     def read_links(self):
         links = self.renderer.get_links(self.index)
+        self.own_items.update(links)
         for link in links:
             link.setParentItem(self)
             if type(link) == InternalLink:
@@ -53,6 +61,12 @@ class Page(SimplePage):
         widgets = self.renderer.get_widgets(self.index)
         for widget in widgets:
             widget.setParentItem(self)
+        self.holds_document = self.holds_document or len(widgets) > 0
+
+    def is_disposable(self):
+        # The annotations are taken out of the document while they are
+        # items and the values of the fields are those of the widgets
+        return super().is_disposable() and not self.holds_document
 
     def toggle_info(self):
         self.info.setVisible(not self.info.isVisible())
@@ -78,8 +92,8 @@ class Page(SimplePage):
             self.signals.item_added.emit(value)
         return super().itemChange(change, value)
 
-    def invalidate(self):
-        super().invalidate()
+    def invalidate(self, rect=None):
+        super().invalidate(rect)
         if self.words is not None:
             for word in self.words:
                 self.scene().removeItem(word)
@@ -0,0 +1,104 @@
+from array import array
+
+
+class PageGeometry:
+    # Mediabox, cropbox and rotation of every page of the document in
+    # a flat array of doubles, read once when the document is opened
+    # (estimated from the first page until all are read, see
+    # DocumentLoader) and then kept up to date by the renderer when a
+    # page is cropped, rotated, inserted or moved. The sizes asked for
+    # by the layout and by the pages never load a MuPDF page
+
+    # mediabox (4), cropbox (4), rotation
+    FIELDS = 9
+    PROGRESS_STEP = 50
+
+    def __init__(self):
+        self.values = array('d')
+        # While estimated, the pages read and whether
+        # any was inserted or moved (see estimate)
+        self.known = None
+        self.moved = False
+
+    def __len__(self):
+        return len(self.values) // self.FIELDS
+
+    @staticmethod
+    def read(page):
+        return tuple(page.mediabox) + tuple(page.cropbox) + (page.rotation,)
+
+    def fill(self, document, progress=None):
+        # progress(done, total) is called every PROGRESS_STEP pages
+        self.values = array('d')
+        self.known, self.moved = None, False
+        for index, page in enumerate(document):
+            self.values.extend(self.read(page))
+            if progress is not None and index % self.PROGRESS_STEP == 0:
+                progress(index, len(document))
+
+    def estimate(self, document):
+        # Only the first page is read, the others are
+        # assumed of its size until complete is called
+        self.values = array('d', self.read(document[0]) * len(document)) if len(document) else array('d')
+        self.known, self.moved = bytearray(len(document)), False
+        if len(document):
+            self.known[0] = 1
+
+    def is_estimated(self):
+        return self.known is not None
+
+    def complete(self, geometry):
+        # The pages not read since estimate are taken from the geometry
+        # filled from the file. False if pages were inserted or moved
+        # meanwhile, the indices no longer match
+        if self.known is None:
+            return True
+        if self.moved or len(geometry) != len(self):
+            return False
+        for index, known in enumerate(self.known):
+            if not known:
+                self.values[index * self.FIELDS:(index + 1) * self.FIELDS] = \
+                    geometry.values[index * self.FIELDS:(index + 1) * self.FIELDS]
+        self.known = None
+        return True
+
+    def update(self, index, page):
+        self.values[index * self.FIELDS:(index + 1) * self.FIELDS] = array('d', self.read(page))
+        if self.known is not None:
+            self.known[index] = 1
+
+    def insert(self, index, page):
+        self.values[index * self.FIELDS:index * self.FIELDS] = array('d', self.read(page))
+        if self.known is not None:
+            self.moved = True
+
+    def rearrange(self, order):
+        values = array('d')
+        for index in order:
+            values.extend(self.values[index * self.FIELDS:(index + 1) * self.FIELDS])
+        self.values = values
+        if self.known is not None:
+            self.moved = True
+
+    def get_mediabox(self, index):
+        return tuple(self.values[index * self.FIELDS:index * self.FIELDS + 4])
+
+    def get_cropbox(self, index):
+        return tuple(self.values[index * self.FIELDS + 4:index * self.FIELDS + 8])
+
+    def get_rotation(self, index):
+        return int(self.values[index * self.FIELDS + 8])
+
+    def is_cropped(self, index):
+        return self.get_cropbox(index) != self.get_mediabox(index)
+
+    def get_size(self, index):
+        # As page.rect: the cropbox, rotated
+        x0, y0, x1, y1 = self.get_cropbox(index)
+        if self.get_rotation(index) % 180 == 90:
+            return y1 - y0, x1 - x0
+        return x1 - x0, y1 - y0
+
+    def get_max_size(self):
+        sizes = [self.get_size(i) for i in range(len(self))]
+        return max((w for w, h in sizes), default=0), max((h for w, h in sizes), default=0)
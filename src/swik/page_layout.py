@@ -0,0 +1,171 @@
+import bisect
+
+from PyQt5.QtCore import QRectF
+
+
+class PageLayout:
+    # Where the pages of a view go (scene coordinates, the size already
+    # scaled) without the need of the page items. Along the scroll
+    # direction the positions are running sums of the sizes, so the
+    # pages in a rect and the place of a page are found by binary
+    # search. A page inserted, rotated or cropped only moves the ones
+    # after it and only that suffix is computed again (all the pages
+    # if the mode, the zoom or the widest or tallest page changed)
+
+    # Position of the first page
+    MARGIN = 20
+
+    def __init__(self, view):
+        self.view = view
+        self.sizes = []
+        self.rects = []
+        self.starts, self.ends = [], []
+        self.scene_rect = QRectF()
+        self.horizontal = False
+        self.params = None
+        self.dirty = 0
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def clear(self):
+        self.sizes = []
+        self.rects = []
+        self.starts, self.ends = [], []
+        self.scene_rect = QRectF()
+        self.params = None
+        self.dirty = 0
+
+    def touch(self, index):
+        self.dirty = index if self.dirty is None else min(self.dirty, index)
+
+    def get_size(self, index):
+        return self.sizes[index]
+
+    def set_sizes(self, sizes):
+        self.sizes = list(sizes)
+        self.touch(0)
+
+    def set_size(self, index, size):
+        if self.sizes[index] != size:
+            self.sizes[index] = size
+            self.touch(index)
+
+    def append(self, sizes):
+        self.touch(len(self.sizes))
+        self.sizes.extend(sizes)
+
+    def insert(self, index, size):
+        self.sizes.insert(index, size)
+        self.touch(index)
+
+    def rearrange(self, indices):
+        # Nothing moves up to the first page of different size
+        sizes = [self.sizes[i] for i in indices]
+        first = 0
+        while first < min(len(sizes), len(self.sizes)) and sizes[first] == self.sizes[first]:
+            first += 1
+        if first < max(len(sizes), len(self.sizes)):
+            self.touch(first)
+        self.sizes = sizes
+
+    def refresh(self):
+        # The sizes changed since the rects were computed (a page
+        # inserted, moved or resized), len() already counts them
+        if self.dirty is not None:
+            self.update()
+
+    def get_rect(self, index):
+        self.refresh()
+        return self.rects[index]
+
+    def get_scene_rect(self):
+        self.refresh()
+        return self.scene_rect
+
+    def get_pages_in_rect(self, rect):
+        self.refresh()
+        low, high = (rect.left(), rect.right()) if self.horizontal else (rect.top(), rect.bottom())
+        first = bisect.bisect_right(self.ends, low)
+        last = bisect.bisect_left(self.starts, high)
+        return [i for i in range(first, last) if self.rects[i].intersects(rect)]
+
+    def update(self):
+        # Returns whether something was computed again
+        view = self.view
+        params = view.mode, view.ratio, view.page_sep, view.viewport().width(), view.viewport().height()
+        if self.dirty is None and self.params is not None and params == self.params[:5]:
+            return False
+
+        mode, ratio, sep, width, height = params
+        max_width = max((w for w, h in self.sizes), default=0)
+        max_height = max((h for w, h in self.sizes), default=0)
+        max_aspect = max((w / h for w, h in self.sizes), default=0)
+
+        cols = 1
+        if mode == view.MODE_VERTICAL_MULTIPAGE and len(self.sizes) > 1:
+            cols = max(width // (max_width * ratio + 2 * sep), 1)
+
+        params = params + (max_width, max_height, max_aspect, cols)
+        if params != self.params:
+            self.params = params
+            self.dirty = 0
+
+        start, self.dirty = min(self.dirty or 0, len(self.sizes)), None
+        del self.rects[start:], self.starts[start:], self.ends[start:]
+        self.horizontal = mode == view.MODE_HORIZONTAL
+        pos = self.ends[-1] + sep if start > 0 else self.MARGIN
+
+        if mode == view.MODE_SINGLE_PAGE:
+            for w, h in self.sizes[start:]:
+                self.add(QRectF(0, self.MARGIN, w * ratio, h * ratio))
+            self.scene_rect = QRectF()
+
+        elif mode in [view.MODE_FIT_WIDTH, view.MODE_FIT_PAGE]:
+            if mode == view.MODE_FIT_WIDTH:
+                scene_width = width - 17
+            else:
+                scene_width = max_aspect * (height - 17)
+            for w, h in self.sizes[start:]:
+                if mode == view.MODE_FIT_WIDTH:
+                    r = (width - 17) / w
+                else:
+                    r = (height - 17) / h
+                self.add(QRectF(scene_width / 2 - w * r / 2, pos, w * r, h * r))
+                pos = pos + h * r + sep
+            self.scene_rect = QRectF(0, 0, scene_width, pos)
+
+        elif mode == view.MODE_HORIZONTAL:
+            for w, h in self.sizes[start:]:
+                w, h = w * ratio, h * ratio
+                self.add(QRectF(pos, max_height * ratio / 2 - h / 2, w, h), pos, pos + w)
+                pos = pos + w + sep
+            self.scene_rect = QRectF(0, 0, pos, max_height * ratio)
+
+        elif cols == 1:
+            scene_width = max_width * ratio
+            for w, h in self.sizes[start:]:
+                w, h = w * ratio, h * ratio
+                self.add(QRectF(scene_width / 2 - w / 2, pos, w, h))
+                pos = pos + h + sep
+            self.scene_rect = QRectF(0, 0, scene_width, pos)
+
+        else:
+            # The cells are as big as the biggest page, the
+            # rows are the spans searched (see get_pages_in_rect)
+            cell_width, cell_height = max_width * ratio, max_height * ratio
+            for i in range(start, len(self.sizes)):
+                w, h = self.sizes[i][0] * ratio, self.sizes[i][1] * ratio
+                row, col = i // cols, i % cols
+                x = sep + col * (cell_width + sep) + (cell_width - w) / 2
+                top = sep + row * (cell_height + sep)
+                self.add(QRectF(x, top + (cell_height - h) / 2, w, h), top, top + cell_height)
+            rows = (len(self.sizes) + cols - 1) // cols
+            self.scene_rect = QRectF(0, 0, sep + min(cols, len(self.sizes)) * (cell_width + sep),
+                                     sep + rows * (cell_height + sep) + sep)
+        return True
+
+    def add(self, rect, start=None, end=None):
+        self.rects.append(rect)
+        self.starts.append(rect.top() if start is None else start)
+        self.ends.append(rect.bottom() if end is None else end)
@@ -0,0 +1,101 @@
+import time
+
+from PyQt5.QtCore import QObject, QTimer
+
+
+class Prefetcher(QObject):
+    # Renders in advance, at low priority, the pages the user is about
+    # to see: the next ones in the scrolling direction (more of them the
+    # faster the scroll), the previous and next page in single page mode
+    # and the destination of the internal links being hovered
+
+    MAX_PAGES = 6
+
+    # Seconds of scroll at the current speed to look ahead
+    LOOKAHEAD = 1.0
+
+    # Share of the render cache that can be used to prefetch, never
+    # more than what is left by the images of the pages on screen,
+    # which would be evicted otherwise (see RenderCache.evict)
+    BUDGET_SHARE = 0.25
+
+    def __init__(self, view):
+        super().__init__(view)
+        self.view = view
+        self.renderer = view.renderer
+        self.direction = 0
+        self.velocity = 0
+        self.last_time = None
+        self.requests = {}
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.prefetch)
+
+    def scrolled(self, delta):
+        if delta == 0:
+            return
+
+        now = time.monotonic()
+        elapsed = now - self.last_time if self.last_time is not None else 1
+        self.last_time = now
+
+        speed = abs(delta) / max(elapsed, 0.001)
+        self.velocity = speed if elapsed > 0.5 else 0.7 * self.velocity + 0.3 * speed
+
+        direction = 1 if delta > 0 else -1
+        if direction != self.direction:
+            # The user went back, what was queued is useless
+            self.cancel()
+            self.direction = direction
+
+        if not self.timer.isActive():
+            self.timer.start(100)
+
+    def page_changed(self, index):
+        self.cancel()
+        self.prefetch_pages([index + 1, index - 1])
+
+    def link_hovered(self, index):
+        self.prefetch_pages([index])
+
+    def prefetch(self):
+        visible = self.view.get_visible_pages()
+        if len(visible) == 0 or self.direction == 0:
+            return
+
+        # The current page may not be an item yet (or anymore)
+        page = self.view.pages.get(self.view.page)
+        if page is None:
+            return
+        extent = page.get_scaled_height() if self.view.is_vertical() else page.get_scaled_width()
+        count = 1 + int(self.velocity * self.LOOKAHEAD / max(extent, 1))
+        count = min(count, self.MAX_PAGES)
+
+        first = max(visible) + 1 if self.direction > 0 else min(visible) - 1
+        self.prefetch_pages([first + i * self.direction for i in range(count)])
+
+    def prefetch_pages(self, indices):
+        self.requests = {index: request for index, request in self.requests.items() if not request.done}
+
+        cache = self.renderer.cache
+        budget = min(cache.budget * self.BUDGET_SHARE, cache.budget - cache.get_visible_size())
+        for index in indices:
+            page = self.view.pages.get(index)
+            if page is None:
+                continue
+
+            # Approximately the size of the (RGB32) image
+            ratio = page.get_render_ratio()
+            budget -= page.get_orig_width() * ratio * page.get_orig_height() * ratio * 4
+            if budget < 0:
+                break
+
+            if index not in self.requests:
+                request = page.prefetch()
+                if request is not None:
+                    self.requests[index] = request
+
+    def cancel(self):
+        for request in self.requests.values():
+            request.cancelled = True
+        self.requests.clear()
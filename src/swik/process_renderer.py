@@ -0,0 +1,119 @@
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import pymupdf
+from PyQt5.QtGui import QImage
+
+from swik.document_pool import DocumentPool, create_display_list
+
+# Document opened by each worker process
+# and the display lists of its pages
+document = None
+source = None
+display_lists = OrderedDict()
+
+
+def open_document(filename, password, revision):
+    global document, source
+    if source != (filename, revision):
+        if document is not None:
+            document.close()
+        document = pymupdf.open(filename)
+        if document.needs_pass and password is not None:
+            document.authenticate(password)
+        source = filename, revision
+        display_lists.clear()
+    return document
+
+
+def get_display_list(filename, password, revision, index, layer):
+    document = open_document(filename, password, revision)
+    display_list = display_lists.get((index, layer))
+    if display_list is None:
+        display_list = display_lists[index, layer] = create_display_list(document[index], layer)
+        if len(display_lists) > DocumentPool.DISPLAY_LISTS:
+            display_lists.popitem(last=False)
+    else:
+        display_lists.move_to_end((index, layer))
+    return display_list
+
+
+def render(filename, password, revision, index, ratio, clip, aa_level, layer):
+    # Runs in the worker process, the samples are handed
+    # over in a shared memory block owned by the caller
+    mat = pymupdf.Matrix(ratio, ratio)
+    display_list = get_display_list(filename, password, revision, index, layer)
+
+    # A process renders one page at a time, the
+    # anti-aliasing level can be changed safely
+    if aa_level is not None:
+        default = pymupdf.TOOLS.show_aa_level()["graphics"]
+        pymupdf.TOOLS.set_aa_level(aa_level)
+        try:
+            pix = display_list.get_pixmap(matrix=mat, clip=clip, alpha=False)
+        finally:
+            pymupdf.TOOLS.set_aa_level(default)
+    else:
+        pix = display_list.get_pixmap(matrix=mat, clip=clip, alpha=False)
+    samples = pix.samples_mv
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(samples)))
+    shm.buf[:len(samples)] = samples
+    shm.close()
+    return shm.name, pix.width, pix.height, pix.stride
+
+
+class ProcessRenderer:
+    # Renders in worker processes, so that neither the GIL nor the
+    # MuPDF global lock are shared with the GUI. Every process opens
+    # the same file the render threads use (see DocumentPool)
+
+    # Below this the processes are not worth it
+    MIN_PAGES = 16
+
+    # The processes are shared by all the renderers (tabs)
+    executor = None
+    users = set()
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def start(self):
+        ProcessRenderer.users.add(self)
+        if ProcessRenderer.executor is None:
+            # Forking a process with running Qt threads is not safe
+            context = multiprocessing.get_context("spawn")
+            ProcessRenderer.executor = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=context)
+
+    def stop(self):
+        ProcessRenderer.users.discard(self)
+        if len(ProcessRenderer.users) == 0 and ProcessRenderer.executor is not None:
+            ProcessRenderer.executor.shutdown(wait=False, cancel_futures=True)
+            ProcessRenderer.executor = None
+
+    def is_running(self):
+        return self in ProcessRenderer.users
+
+    def render(self, index, ratio, clip=None, aa_level=None, layer=DocumentPool.LAYER_ALL):
+        # Returns None if the page could not be rendered (e.g. the
+        # snapshot was replaced meanwhile): the caller falls back
+        filename, password, revision = self.documents.get_source()
+        try:
+            name, width, height, stride = self.executor.submit(render, filename, password, revision,
+                                                               index, ratio, clip, aa_level, layer).result()
+        except Exception:
+            return None
+
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            # Wrap the shared block and convert it (to the format QPainter
+            # draws without conversion) before releasing it
+            image = QImage(shm.buf, width, height, stride, QImage.Format_RGB888)
+            owned = image.convertToFormat(QImage.Format_RGB32)
+            del image
+        finally:
+            shm.close()
+            shm.unlink()
+        return owned
@@ -0,0 +1,37 @@
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+
+class QualityGovernor(QObject):
+    # Tells the pages of a view when the user is scrolling or zooming.
+    # Meanwhile the pages only scale the images they already have (and
+    # ask for low quality previews of the pages with none), so that the
+    # images of the intermediate positions and zoom levels are not
+    # rendered. When the view has been idle for IDLE_TIME ms the pages
+    # are repainted: only the visible ones ask for the final images
+
+    # Milliseconds without scroll or zoom to be idle again
+    IDLE_TIME = 150
+
+    idle = pyqtSignal()
+
+    def __init__(self, view):
+        super().__init__(view)
+        self.interacting = False
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.timeout)
+
+    def moved(self):
+        # A single jump (e.g. to a page) is not an interaction,
+        # a second movement before IDLE_TIME ms starts one
+        if self.timer.isActive():
+            self.interacting = True
+        self.timer.start(self.IDLE_TIME)
+
+    def timeout(self):
+        if self.interacting:
+            self.interacting = False
+            self.idle.emit()
+
+    def is_interacting(self):
+        return self.interacting
@@ -0,0 +1,138 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class RenderCache:
+    # Images rendered by the renderer, shared by all the views.
+    # Keys are (page_id, ratio, rotation, tile) tuples where tile is
+    # None for a whole page image, (col, row) for a tile, PREVIEW for
+    # a quick low quality image of the whole page or ANNOTATIONS for
+    # the transparent image of the annotations of the page. The total
+    # size of the images is kept below the budget evicting first the
+    # least recently used images of the pages that are not on screen.
+
+    PREVIEW = "preview"
+    ANNOTATIONS = "annotations"
+
+    def __init__(self, budget_mb=256):
+        self.budget = budget_mb * 1024 * 1024
+        self.entries = OrderedDict()
+        self.by_page = {}
+        self.visible = {}
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self.lock = Lock()
+
+    @staticmethod
+    def get_image_size(image):
+        return image.bytesPerLine() * image.height()
+
+    def set_budget(self, budget_mb):
+        with self.lock:
+            self.budget = budget_mb * 1024 * 1024
+            self.evict()
+
+    def get_budget(self):
+        return self.budget // (1024 * 1024)
+
+    def get_size(self):
+        return self.size
+
+    def get_visible_size(self):
+        # What the pages on screen hold, evicted only after the others
+        with self.lock:
+            return sum(self.get_image_size(self.entries[key]) for page_id in set().union(*self.visible.values())
+                       for key in self.by_page.get(page_id, ()))
+
+    def set_visible(self, owner, page_ids):
+        # Each view reports the pages it is showing
+        with self.lock:
+            self.visible[owner] = set(page_ids)
+
+    def get_visible(self):
+        with self.lock:
+            return set().union(*self.visible.values())
+
+    def is_visible(self, page_id):
+        return any(page_id in ids for ids in self.visible.values())
+
+    def get(self, key):
+        with self.lock:
+            image = self.entries.get(key)
+            if image is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return image
+
+    def get_closest(self, page_id, ratio, rotation):
+        # Best whole page image available for the page, used as
+        # a stand-in while the one at the right ratio is rendered
+        with self.lock:
+            best, best_score = None, None
+            for key in self.by_page.get(page_id, ()):
+                _, key_ratio, key_rotation, tile = key
+                if tile not in [None, self.PREVIEW] or key_rotation != rotation:
+                    continue
+                # At the same distance, final images are better than previews
+                score = abs(key_ratio - ratio), tile == self.PREVIEW
+                if best is None or score < best_score:
+                    best, best_score = key, score
+            return (self.entries[best], best[1]) if best is not None else (None, None)
+
+    def get_page_images(self, page_id):
+        with self.lock:
+            return [(key, self.entries[key]) for key in self.by_page.get(page_id, ())]
+
+    def put(self, key, image):
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = image
+            self.by_page.setdefault(key[0], set()).add(key)
+            self.size += self.get_image_size(image)
+            self.evict(key)
+
+    def remove(self, key):
+        image = self.entries.pop(key)
+        self.size -= self.get_image_size(image)
+        keys = self.by_page.get(key[0])
+        keys.discard(key)
+        if len(keys) == 0:
+            self.by_page.pop(key[0])
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+
+    def evict(self, keep=None):
+        if self.size <= self.budget:
+            return
+
+        # First the pages that are not shown, then
+        # the others, always from the least recently used
+        for only_hidden in [True, False]:
+            for key in list(self.entries.keys()):
+                if self.size <= self.budget:
+                    return
+                if key == keep or (only_hidden and self.is_visible(key[0])):
+                    continue
+                self.remove(key)
+                self.evictions += 1
+
+    def invalidate(self, page_id):
+        with self.lock:
+            for key in list(self.by_page.get(page_id, ())):
+                self.remove(key)
+
+    def reset_counters(self):
+        with self.lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.by_page.clear()
+            self.size = 0
@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class RenderMetrics:
+    # Where the time of the render pipeline goes. For every job: time
+    # waiting in the queue, rasterisation (MuPDF), conversion to QImage,
+    # total latency until delivered and size of the image. Together with
+    # the counters of skipped and stale renders and those of the render
+    # cache (hits, misses and evictions) it is available through
+    # get_summary() and, if enabled, appended as JSON lines to a log
+    # file that is rotated when it reaches MAX_LOG_SIZE bytes
+
+    HISTORY = 1000
+    MAX_LOG_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.records = deque(maxlen=self.HISTORY)
+        self.counters = {}
+        self.log_path = None
+
+    @staticmethod
+    def get_default_log_path():
+        return os.path.join(os.path.expanduser('~'), '.cache', 'swik', 'render_metrics.jsonl')
+
+    def set_log(self, path):
+        # None disables the log
+        self.log_path = path
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def start(self):
+        # Called by the render thread before rendering a job
+        self.local.times = {}
+
+    def measure(self, name, started):
+        # Time spent since started (a perf_counter() value) by the current job
+        times = getattr(self.local, "times", None)
+        if times is not None:
+            times[name] = times.get(name, 0) + time.perf_counter() - started
+
+    def finish(self):
+        times, self.local.times = getattr(self.local, "times", None), None
+        return times if times is not None else {}
+
+    def record(self, job, image, dropped=None):
+        # Called in the GUI thread when the job is delivered
+        now = time.perf_counter()
+        kind = "annotations" if job.annotations else "preview" if job.preview else \
+            "page" if job.tile is None else "tile"
+        record = {"time": time.time(), "page": job.index, "kind": kind, "ratio": round(job.ratio, 4),
+                  "priority": job.priority, "requests": len(job.requests),
+                  "wait": job.started - job.queued if job.started is not None else None,
+                  "raster": job.times.get("raster"), "convert": job.times.get("convert"),
+                  "latency": now - job.queued, "bytes": image.bytesPerLine() * image.height(), "dropped": dropped}
+
+        with self.lock:
+            self.records.append(record)
+        self.count("dropped_" + dropped if dropped is not None else "delivered")
+        if self.log_path is not None:
+            self.write(record)
+
+    def write(self, record):
+        try:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > self.MAX_LOG_SIZE:
+                os.replace(self.log_path, self.log_path + ".1")
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError:
+            pass
+
+    def get_records(self):
+        with self.lock:
+            return list(self.records)
+
+    @staticmethod
+    def get_stats(values):
+        values = sorted(value for value in values if value is not None)
+        if len(values) == 0:
+            return None
+        return {"count": len(values), "mean": sum(values) / len(values), "p50": values[len(values) // 2],
+                "p95": values[min(len(values) - 1, int(len(values) * 0.95))], "max": values[-1]}
+
+    def get_summary(self):
+        records = [record for record in self.get_records() if record["dropped"] is None]
+        with self.lock:
+            summary = dict(self.counters)
+        summary.update({"cache_hits": self.cache.hits, "cache_misses": self.cache.misses,
+                        "cache_evictions": self.cache.evictions, "cache_size": self.cache.get_size()})
+        lookups = self.cache.hits + self.cache.misses
+        summary["cache_hit_rate"] = self.cache.hits / lookups if lookups > 0 else None
+        summary["bytes"] = sum(record["bytes"] for record in records)
+        for name in ["wait", "raster", "convert", "latency"]:
+            summary[name] = self.get_stats(record[name] for record in records)
+        return summary
+
+    def reset(self):
+        with self.lock:
+            self.records.clear()
+            self.counters.clear()
+        self.cache.reset_counters()
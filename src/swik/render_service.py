@@ -0,0 +1,280 @@
+import heapq
+import itertools
+import time
+import traceback
+from threading import Condition
+
+import pymupdf
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QThread, pyqtSignal
+from PyQt5.QtGui import QImage
+
+from swik.document_pool import DocumentPool
+
+
+class RenderRequest:
+    # Priority classes, higher first
+    PRIORITY_VISIBLE = 2
+    PRIORITY_MINIATURE = 1
+    PRIORITY_PREFETCH = 0
+
+    def __init__(self, document_generation, page_id, index, ratio, generation, signals, tile=None, rect=None,
+                 preview=False, priority=PRIORITY_VISIBLE, version=0, annotations=False, gray=False,
+                 display_list=None, fingerprint=None, layer=DocumentPool.LAYER_ALL):
+        self.document_generation = document_generation
+        self.page_id = page_id
+        self.version = version
+        self.index = index
+        self.ratio = ratio
+        self.generation = generation
+        self.signals = signals
+        self.tile = tile
+        self.rect = rect
+        self.preview = preview
+        self.annotations = annotations
+        self.gray = gray
+        self.display_list = display_list
+        # Of the page, with or without the annotations (tiles always with them)
+        self.layer = layer
+        # Looked up in the thumbnail cache under it, and stored there
+        self.fingerprint = fingerprint
+        self.priority = priority
+        self.cancelled = False
+        self.done = False
+
+    def get_key(self):
+        return self.document_generation, self.page_id, self.version, self.ratio, self.tile, self.preview, \
+            self.annotations, self.gray, self.fingerprint, self.layer
+
+    def is_pending(self):
+        return not self.cancelled and not self.done
+
+
+class RenderJob:
+    # Identical requests (same page, ratio and tile) share one render
+    def __init__(self, request):
+        self.key = request.get_key()
+        self.document_generation = request.document_generation
+        self.page_id = request.page_id
+        self.version = request.version
+        self.index = request.index
+        self.ratio = request.ratio
+        self.tile = request.tile
+        self.rect = request.rect
+        self.preview = request.preview
+        self.annotations = request.annotations
+        self.gray = request.gray
+        self.display_list = request.display_list
+        self.layer = request.layer
+        self.fingerprint = request.fingerprint
+        self.priority = request.priority
+        self.requests = [request]
+        self.running = False
+        self.queued = time.perf_counter()
+        self.started = None
+        self.times = {}
+
+    def is_cancelled(self):
+        return all(request.cancelled for request in self.requests)
+
+    def is_stale(self, renderer):
+        # The document or the page changed after the request
+        return self.document_generation != renderer.get_generation() \
+            or self.version != renderer.get_page_version(self.page_id)
+
+
+class AntiAliasGate:
+    # The anti-aliasing level of MuPDF is global: renders at different
+    # levels cannot overlap, renders at the same level can. Once a render
+    # at another level is waiting no new render at the current one starts
+
+    def __init__(self):
+        self.condition = Condition()
+        self.default = pymupdf.TOOLS.show_aa_level()["graphics"]
+        self.level = self.default
+        self.running = 0
+        self.waiting = {}
+
+    def can_start(self, level):
+        if self.running == 0:
+            return True
+        others = sum(count for key, count in self.waiting.items() if key != level)
+        return level == self.level and others == 0
+
+    def acquire(self, level=None):
+        level = self.default if level is None else level
+        with self.condition:
+            while not self.can_start(level):
+                self.waiting[level] = self.waiting.get(level, 0) + 1
+                self.condition.wait()
+                self.waiting[level] -= 1
+            if level != self.level:
+                pymupdf.TOOLS.set_aa_level(level)
+                self.level = level
+            self.running += 1
+
+    def release(self):
+        with self.condition:
+            self.running -= 1
+            if self.running == 0:
+                self.condition.notify_all()
+
+
+aa_gate = AntiAliasGate()
+
+
+class RenderWorker(QRunnable):
+    def __init__(self, service, job):
+        super().__init__()
+        self.service = service
+        self.job = job
+
+    def run(self):
+        job = self.job
+        job.started = time.perf_counter()
+        renderer = self.service.renderer
+        metrics = renderer.metrics
+        metrics.start()
+        image = QImage()
+        try:
+            if not job.is_cancelled() and not job.is_stale(renderer):
+                # The pages not edited are found in the file the threads read
+                index = job.index if job.display_list is not None else renderer.documents.get_index(job.page_id)
+                if job.fingerprint is None:
+                    image = self.render(renderer, job, index)
+                else:
+                    # Read from the disk if there, rendered and stored if not
+                    page_hash = renderer.get_page_hash(index, job.layer)
+                    image = renderer.load_thumbnail(index, job.ratio, job.fingerprint, page_hash)
+                    if image is None:
+                        image = self.render(renderer, job, index)
+                        renderer.save_thumbnail(job.fingerprint, page_hash, image)
+        except Exception:
+            # Delivered as skipped, so that the slot is freed and the
+            # job dropped: the page asks again the next time it is painted
+            traceback.print_exc()
+            image = QImage()
+        finally:
+            job.times = metrics.finish()
+            try:
+                self.service.rendered.emit(job, image)
+            except RuntimeError:
+                # The service was deleted meanwhile (tab closed or application quitting)
+                pass
+
+    @staticmethod
+    def render(renderer, job, index):
+        if job.annotations:
+            image = renderer.render_annotations(index, job.ratio, job.rect, job.display_list)
+        elif job.tile is None:
+            image = renderer.render_page(index, job.ratio, job.preview, job.display_list, job.layer)
+        else:
+            image = renderer.render_tile(index, job.ratio, job.rect, job.display_list)
+
+        if job.gray and not image.isNull():
+            image = renderer.reduce_depth(job.page_id, job.layer, image)
+        return image
+
+
+class RenderService(QObject):
+    # Renders pages and tiles out of the GUI thread. The requests are
+    # queued by priority class (previews first within a class) and at
+    # most one job per core is running. The result is delivered, in the
+    # GUI thread, through the signals of the pages that requested it
+    # (image_prepared, preview_prepared, annotations_prepared or tile_prepared)
+
+    rendered = pyqtSignal(object, QImage)
+
+    def __init__(self, renderer):
+        super().__init__()
+        self.renderer = renderer
+        self.max_running = QThread.idealThreadCount()
+        self.running = 0
+        self.queue = []
+        self.jobs = {}
+        self.counter = itertools.count()
+
+        # Kept alive since each thread holds its own copy of the document
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(self.max_running)
+        self.pool.setExpiryTimeout(-1)
+        self.rendered.connect(self.deliver)
+
+    def request(self, request):
+        job = self.jobs.get(request.get_key())
+        if job is None:
+            job = self.jobs[request.get_key()] = RenderJob(request)
+            self.push(job)
+        else:
+            job.requests.append(request)
+            if request.priority > job.priority and not job.running:
+                job.priority = request.priority
+                self.push(job)
+
+        self.dispatch()
+        return request
+
+    def push(self, job):
+        # A job pushed again with a higher priority leaves a stale entry
+        heapq.heappush(self.queue, (-job.priority, not job.preview, next(self.counter), job))
+
+    def dispatch(self):
+        while self.running < self.max_running and len(self.queue) > 0:
+            priority, _, _, job = heapq.heappop(self.queue)
+            if job.running or -priority != job.priority or self.jobs.get(job.key) is not job:
+                continue
+
+            if job.is_cancelled():
+                self.jobs.pop(job.key)
+                self.renderer.metrics.count("skipped")
+                continue
+
+            job.running = True
+            self.running += 1
+            self.pool.start(RenderWorker(self, job))
+
+    def cancel_pages(self, page_ids):
+        # Pages that are not on screen anymore, prefetches are kept
+        for job in self.jobs.values():
+            if job.page_id in page_ids and not job.running:
+                for request in job.requests:
+                    if request.priority != RenderRequest.PRIORITY_PREFETCH:
+                        request.cancelled = True
+
+    def cancel_all(self):
+        for job in self.jobs.values():
+            for request in job.requests:
+                request.cancelled = True
+        self.queue.clear()
+        self.jobs = {key: job for key, job in self.jobs.items() if job.running}
+
+    def deliver(self, job, image):
+        self.running -= 1
+        if self.jobs.get(job.key) is job:
+            self.jobs.pop(job.key)
+        self.dispatch()
+
+        for request in job.requests:
+            request.done = True
+
+        # Skipped or rendered for a previous version of the document or
+        # the page: the pages will ask again for it the next time they are painted
+        dropped = "stale" if job.is_stale(self.renderer) else "skipped" if image.isNull() else None
+        self.renderer.metrics.record(job, image, dropped)
+        if dropped is not None:
+            for request in job.requests:
+                request.cancelled = True
+            return
+
+        for request in job.requests:
+            if request.preview:
+                request.signals.preview_prepared.emit(image, request.ratio, request.generation)
+            elif request.annotations:
+                request.signals.annotations_prepared.emit(image, request.ratio, request.generation)
+            elif request.tile is None:
+                request.signals.image_prepared.emit(image, request.ratio, request.generation)
+            else:
+                col, row = request.tile
+                request.signals.tile_prepared.emit(request.generation, col, row, request.ratio, image)
+
+    def wait(self):
+        self.pool.waitForDone()
@@ -1,15 +1,15 @@
+import hashlib
 import os
+import re
 import shutil
 import tempfile
 import time
 import traceback
-from os.path import exists
 
 import pymupdf
-from PyQt5 import QtCore
-from PyQt5.QtCore import Qt, QRunnable, QThreadPool, pyqtSignal, QMutex, QRectF, QRect, QByteArray, QBuffer, QIODevice, \
-    QTimer, QPointF, QFileSystemWatcher
-from PyQt5.QtGui import QPixmap, QImage, QBrush, QPen, QColor
+from PyQt5.QtCore import Qt, pyqtSignal, QRectF, QRect, QByteArray, QBuffer, QIODevice, QPointF, QFileSystemWatcher, \
+    QPoint, QThread
+from PyQt5.QtGui import QImage, QBrush, QPen, QColor, QPainter
 from PyQt5.QtWidgets import QLabel
 from pymupdf import TEXTFLAGS_DICT, TEXT_PRESERVE_IMAGES, TextWriter, Font, Point, Document, Rect, Quad, Annot
 from pymupdf.mupdf import PDF_ENCRYPT_KEEP, PDF_WIDGET_TYPE_TEXT, PDF_WIDGET_TYPE_CHECKBOX, PDF_ANNOT_IS_LOCKED, \
@@ -20,47 +20,22 @@ import swik.utils as utils
 from swik.annotations.highlight_annotation import HighlightAnnotation
 from swik.annotations.hyperlink import ExternalLink, InternalLink
 from swik.annotations.square_annotation import SquareAnnotation
+from swik.document_pool import DocumentPool, get_annotations_bbox
 from swik.font_manager import Base14Font
+from swik.page_geometry import PageGeometry
+from swik.process_renderer import ProcessRenderer
+from swik.render_cache import RenderCache
+from swik.render_metrics import RenderMetrics
+from swik.render_service import RenderService, RenderRequest, aa_gate
 from swik.span import Span
 from swik.swik_text import SwikText, SwikTextReplace
+from swik.thumbnail_cache import ThumbnailCache
 from swik.utils import fitz_rect_to_qrectf
 from swik.widgets.pdf_widget import PdfTextWidget, MultiLinePdfTextWidget, PdfCheckboxWidget, PdfWidget, \
     PdfRadioButtonWidget, PdfComboboxWidget
 from swik.word import Word
 
 
-class Image:
-    def __init__(self, w, h):
-        self.image = QPixmap(int(w), int(h))
-        self.ratio = 1
-        self.loaded = False
-        self.image.fill(Qt.white)
-        self.w = w
-        self.h = h
-
-    def update(self, w, h):
-        self.image = QPixmap(int(w), int(h))
-        self.ratio = 1
-        self.loaded = False
-        self.image.fill(Qt.white)
-        self.w = w
-        self.h = h
-
-    def get_image(self, ratio):
-        if self.ratio != ratio:
-            res = self.image.scaledToWidth(int(self.w * ratio), QtCore.Qt.FastTransformation)
-            return res
-        else:
-            return self.image
-
-    def set_image(self, image, ratio):
-        self.image = image
-        self.ratio = ratio
-
-    def get_orig_size(self):
-        return self.w, self.h
-
-
 def convert_box_to_upside_down(filename, index, rect):
     # The signing is not done using PyMuPDF, so we need to compute
     # the square in the pyhanko page (which to make everything
@@ -99,16 +74,81 @@ def convert_box_to_upside_down(filename, index, rect):
     return box
 
 
+class DocumentLoader(QThread):
+    # Opening in stages: the document is parsed here and handed to the
+    # renderer (ready) with the size of the first page for all the
+    # others, so the restored page is shown without waiting for the
+    # whole file. The geometry of every page is then read (reporting
+    # the progress) from a document of its own, the first one belongs
+    # to the GUI thread by then, and completed by the renderer when
+    # the thread finishes. The visible pages are read and rendered
+    # first, their items when shown and the miniatures in background
+    # (see GraphView.page_scrolled and RenderService)
+
+    progress = pyqtSignal(int, int)
+    ready = pyqtSignal()
+
+    def __init__(self, file, password=None, parent=None):
+        super().__init__(parent)
+        self.file = file
+        self.password = password
+        self.needs_pass = False
+        self.document = None
+        self.geometry = PageGeometry()
+        self.measured = None
+        self.result = None
+
+    def run(self):
+        try:
+            document = self.open()
+            if document is None:
+                self.result = MuPDFRenderer.OPEN_REQUIRES_PASSWORD
+            else:
+                self.geometry.estimate(document)
+                self.document = document
+                self.result = MuPDFRenderer.OPEN_OK
+
+        except:
+            traceback.print_exc()
+            self.result = MuPDFRenderer.OPEN_ERROR
+
+        self.ready.emit()
+        if self.result != MuPDFRenderer.OPEN_OK:
+            return
+
+        try:
+            document = self.open()
+            measured = PageGeometry()
+            measured.fill(document, self.progress.emit)
+            document.close()
+            self.measured = measured
+
+        except:
+            traceback.print_exc()
+
+    def open(self):
+        document = Document(self.file)
+        if document.needs_pass:
+            self.needs_pass = True
+            if self.password is None:
+                return None
+            document.authenticate(self.password)
+        return document
+
+
 class MuPDFRenderer(QLabel):
     # Signals
     document_changed = pyqtSignal()
     document_about_to_change = pyqtSignal()
-    image_ready = pyqtSignal(int, float, QImage)
     sync_requested = pyqtSignal()
     sync_dynamic = pyqtSignal()
     page_updated = pyqtSignal(int)
     words_changed = pyqtSignal(int)
     file_changed = pyqtSignal(str)
+    open_progress = pyqtSignal(int, int)
+    open_finished = pyqtSignal(int)
+    geometry_completed = pyqtSignal()
+    annotation_removed = pyqtSignal(int, QRectF)
 
     # Constants
     OPEN_OK = 1
@@ -119,186 +159,667 @@ class MuPDFRenderer(QLabel):
     FLATTEN_WORKAROUND = 1
     FLATTEN_ERROR = 2
 
+    BACKEND_THREADS = 0
+    BACKEND_PROCESSES = 1
+
+    # Anti-aliasing of the previews of progressive rendering
+    PREVIEW_AA_LEVEL = 0
+
+    # Edits covering more than this fraction of the page are
+    # rendered again in background instead of patched in place
+    PATCH_MAX_AREA = 0.5
+
+    # Keys of the objects the page hash does not depend on
+    # (see get_object_digest), they change when saved
+    UNHASHED_KEYS = {"Length", "Filter", "DecodeParms", "Parent"}
+
     def __init__(self):
         super().__init__()
         self.filename = None
-        self.images = []
+        self.source_stat = None
+        self.dynamic_annots = None
+        self.loader = None
+        self.opening = False
+        self.cache = RenderCache()
+        self.metrics = RenderMetrics(self.cache)
+        self.documents = DocumentPool()
+        self.processes = ProcessRenderer(self.documents)
+        self.progressive = True
+        self.thumbnails = ThumbnailCache()
+        self.thumbnails_enabled = True
+        self.fingerprint = None
+        self.page_versions = {}
+        self.layered = True
+        self.annotation_rects = {}
+        self.blended_pages = {}
+        self.low_memory = False
+        self.gray_pages = {}
+        self.fields_index = None
+        self.geometry = PageGeometry()
+        self.service = RenderService(self)
         self.document = None
-        self.mutex = []
-        self.max_width = 0
-        self.max_height = 0
-        self.h = QThreadPool()
-        self.h.setMaxThreadCount(100)
-        self.request_queue_timer = QTimer()
-        self.request_queue_timer.setSingleShot(True)
-        self.request_queue_timer.timeout.connect(self.process_request_queue)
-        self.request_queue = {}
+        self.generation = 0
         self.watcher = QFileSystemWatcher()
         self.password = None
         self.watcher.fileChanged.connect(self.file_has_changed)
 
     def file_has_changed(self, file):
+        # The document keeps reading the file it opened, the rendering
+        # threads must not open the new one meanwhile: they read a
+        # snapshot of the document instead (see DocumentPool.reset)
+        self.documents.reset(self.document, password=self.password)
         self.file_changed.emit(file)
 
     def open_pdf(self, file, password=None):
+        self.set_filename(file)
+        loader = DocumentLoader(file, password)
+        loader.run()
+        result = self.document_loaded(loader)
+        self.geometry_loaded(loader)
+        return result
+
+    def open_pdf_async(self, file, password=None):
+        # As open_pdf but the document is parsed and the geometry of
+        # its pages read in a thread (see DocumentLoader), the result
+        # is emitted by open_finished and geometry_completed is emitted
+        # when the sizes of all the pages are known
+        self.set_filename(file)
+        self.loader = DocumentLoader(file, password, self)
+        self.opening = True
+        self.loader.progress.connect(self.open_progress)
+        self.loader.ready.connect(lambda loader=self.loader: self.loader_ready(loader))
+        self.loader.finished.connect(lambda loader=self.loader: self.loader_finished(loader))
+        self.loader.start()
+
+    def loader_ready(self, loader):
+        # Another file was opened meanwhile
+        if loader is self.loader:
+            self.opening = False
+            self.open_finished.emit(self.document_loaded(loader))
+
+    def loader_finished(self, loader):
+        loader.deleteLater()
+        if loader is self.loader:
+            self.loader = None
+            self.geometry_loaded(loader)
+
+    def is_opening(self):
+        return self.loader is not None and self.opening
+
+    def is_measuring(self):
+        # The document is set, the geometry still estimated
+        return self.loader is not None and not self.opening
+
+    def document_loaded(self, loader):
+        if loader.needs_pass:
+            self.password = loader.password
+        if loader.result == self.OPEN_OK:
+            self.set_document(loader.document, True, pristine=True, geometry=loader.geometry)
+
+            # What the file was like when read
+            self.source_stat = self.get_file_stat(self.filename)
+        return loader.result
+
+    def geometry_loaded(self, loader):
+        if loader.result != self.OPEN_OK:
+            return
+
+        # Unless the document was set again meanwhile. If pages were
+        # inserted or moved, or the file could not be read, read here
+        if self.geometry.is_estimated():
+            if loader.measured is None or not self.geometry.complete(loader.measured):
+                self.geometry.fill(self.document)
+        self.geometry_completed.emit()
+
+    def set_filename(self, file):
         self.filename = file
 
         if self.watcher.files():
             self.watcher.removePaths(self.watcher.files())
         self.watcher.addPath(self.filename)
 
+    @staticmethod
+    def get_file_stat(filename):
         try:
-            self.document = Document(file)
-            if self.document.needs_pass:
-                self.password = password
-
-                if password is None:
-                    return self.OPEN_REQUIRES_PASSWORD
-                else:
-                    self.document.authenticate(password)
-
-            self.set_document(self.document, True)
-            return self.OPEN_OK
-
-        except:
-            traceback.print_exc()
-            return self.OPEN_ERROR
+            stat = os.stat(filename)
+            return stat.st_size, stat.st_mtime_ns
+        except OSError:
+            return None
+
+    def can_save_incrementally(self, filename):
+        # Only onto the file the document was read from (see source_stat)
+        # and if nobody else has written it since it was read
+        return filename == self.filename and self.source_stat is not None \
+            and self.source_stat == self.get_file_stat(filename) and self.document.can_save_incrementally()
+
+    def write_dynamic_annots(self):
+        # The annotations that are items of the scene, as
+        # (index, xref), written until they are removed again
+        self.dynamic_annots = []
+        self.sync_dynamic.emit()
+        annots, self.dynamic_annots = self.dynamic_annots, None
+        return annots
 
-    def save_pdf(self, filename, emit=True):
+    def remove_dynamic_annots(self, annots):
+        # The document had them as items of the scene before
+        for index, xref in annots:
+            page = self.document[index]
+            annot = page.load_annot(xref)
+            rect = fitz_rect_to_qrectf(annot.rect)
+            page.delete_annot(annot)
+            self.touch_page(index)
+            self.annotation_removed.emit(index, rect)
+
+    def save_incrementally(self):
+        annots = self.write_dynamic_annots()
+        self.document.save(self.filename, incremental=True, encryption=PDF_ENCRYPT_KEEP)
+        self.remove_dynamic_annots(annots)
+        self.source_stat = self.get_file_stat(self.filename)
+
+    def save_pdf(self, filename, emit=True, full=False):
+        # Incremental (only the changes are appended to the file) if
+        # possible, full also drops the objects no longer used
         print("Saving to in renderer", filename)
         if self.watcher.files():
             self.watcher.removePaths(self.watcher.files())
 
         self.sync_requested.emit()
-        orig_data = self.document.tobytes(encryption=PDF_ENCRYPT_KEEP, deflate=True, garbage=3)
-        orig_doc = pymupdf.open("pdf", orig_data)
+        if not full and self.can_save_incrementally(filename):
+            self.save_incrementally()
+            self.watcher.addPath(self.filename)
+            return True
 
-        self.sync_dynamic.emit()
+        # The objects are renumbered when saved, the
+        # annotations are found again by their position
+        annots = self.write_dynamic_annots()
+        positions = [(index, [annot[0] for annot in self.document[index].annot_xrefs()].index(xref))
+                     for index, xref in annots]
 
         if filename != self.get_filename():
             print("Saving to2", filename)
             self.document.save(filename, encryption=PDF_ENCRYPT_KEEP, deflate=True, garbage=3)
         else:
             print("Saving to3", filename)
-            tmp_dir = tempfile.gettempdir() + os.sep
-            temp_filename = tmp_dir + "swik_{}.tmp".format(int(time.time()))
+            # Written aside, in the same folder, and renamed onto the file:
+            # whoever still reads it (the document, the render threads and
+            # processes) keeps reading the old one, never half a file
+            fd, temp_filename = tempfile.mkstemp(prefix=".swik_", suffix=".tmp",
+                                                 dir=os.path.dirname(os.path.abspath(filename)))
+            os.close(fd)
+            try:
+                self.document.save(temp_filename, encryption=PDF_ENCRYPT_KEEP, deflate=True, garbage=3)
+                shutil.copymode(filename, temp_filename)
+            except:
+                os.remove(temp_filename)
+                raise
 
-            self.document.save(temp_filename, encryption=PDF_ENCRYPT_KEEP, deflate=True, garbage=3)
+            # Nobody opens the file again until it is read back
+            self.documents.detach()
             self.document.close()
-
-            shutil.copy2(temp_filename, filename)
-
-            if exists(temp_filename):
-                os.remove(temp_filename)
+            os.replace(temp_filename, filename)
 
         self.filename = filename
         self.watcher.addPath(self.filename)
 
-        self.set_document(orig_doc, False)
+        # Read back from the file, so that the next
+        # save can be incremental onto it again
+        document = pymupdf.open(filename)
+        if document.needs_pass and self.password is not None:
+            document.authenticate(self.password)
+        self.set_document(document, False, pristine=True)
+        self.source_stat = self.get_file_stat(self.filename)
+        self.remove_dynamic_annots([(index, self.document[index].annot_xrefs()[position][0])
+                                    for index, position in positions])
         return True
 
     def get_page_size(self, index):
-        return self.document[index].rect[2], self.document[index].rect[3]
+        return self.geometry.get_size(index)
 
     def get_page_width(self, index):
-        return self.document[index].rect[2]
+        return self.geometry.get_size(index)[0]
 
     def get_page_height(self, index):
-        return self.document[index].rect[3]
+        return self.geometry.get_size(index)[1]
+
+    def get_page_id(self, index):
+        # The xref of the page object identifies the page
+        # even when the pages are rearranged
+        return self.document.page_xref(index)
+
+    def get_rotation(self, index):
+        return self.geometry.get_rotation(index)
+
+    def get_cache_key(self, index, ratio, tile=None):
+        return self.get_page_id(index), ratio, self.get_rotation(index), tile
+
+    def set_cache_budget(self, budget_mb):
+        self.cache.set_budget(budget_mb)
+
+    def set_visible_pages(self, owner, indices):
+        visible = self.cache.get_visible()
+        self.cache.set_visible(owner, [self.get_page_id(index) for index in indices])
+
+        # Do not render the pages that went out of sight
+        self.service.cancel_pages(visible - self.cache.get_visible())
+
+    def get_cached_image(self, index, ratio, tile=None):
+        return self.cache.get(self.get_cache_key(index, ratio, tile))
+
+    def get_closest_image(self, index, ratio):
+        return self.cache.get_closest(self.get_page_id(index), ratio, self.get_rotation(index))
+
+    def set_image(self, index, image, ratio, tile=None):
+        self.cache.put(self.get_cache_key(index, ratio, tile), image)
+
+    def invalidate_images(self, index):
+        self.cache.invalidate(self.get_page_id(index))
+        self.touch_page(index)
+
+    def touch_page(self, index):
+        # The content of the page has changed: renders
+        # requested before are dropped when they arrive
+        page_id = self.get_page_id(index)
+        self.page_versions[page_id] = self.get_page_version(page_id) + 1
+        self.annotation_rects.pop(page_id, None)
+        self.blended_pages.pop(page_id, None)
+        for layer in [DocumentPool.LAYER_ALL, DocumentPool.LAYER_CONTENT]:
+            self.gray_pages.pop((page_id, layer), None)
+        self.documents.edit(page_id)
+
+    def invalidate_annotations(self, index):
+        # Only the annotations have changed: the content of the page
+        # is still good if rendered without them, unless it is rendered
+        # with them, before or after the change (see get_content_layer)
+        layer = self.get_content_layer(index)
+        self.touch_page(index)
+        if DocumentPool.LAYER_ALL in [layer, self.get_content_layer(index)]:
+            self.invalidate_images(index)
+            return
+
+        for key, _ in self.cache.get_page_images(self.get_page_id(index)):
+            if key[3] not in [None, RenderCache.PREVIEW]:
+                self.cache.discard(key)
+
+    def set_layered(self, value):
+        if value != self.layered:
+            self.layered = value
+            self.cache.clear()
+            self.generation += 1
+            self.service.cancel_all()
+
+    def is_layered(self):
+        return self.layered
+
+    def set_metrics_log(self, enabled):
+        self.metrics.set_log(RenderMetrics.get_default_log_path() if enabled else None)
+
+    def set_low_memory(self, value):
+        self.low_memory = value
+
+    def is_low_memory(self):
+        return self.low_memory
+
+    def reduce_depth(self, page_id, layer, image):
+        # Called from the render threads. Pages with nothing but shades of
+        # gray are kept in 8 bits per pixel instead of 32, exactly the same.
+        # Per layer: the annotations may have the color the content has not
+        started = time.perf_counter()
+        gray = self.gray_pages.get((page_id, layer))
+        if gray is None:
+            gray = self.gray_pages[page_id, layer] = image.allGray()
+        if gray:
+            image = image.convertToFormat(QImage.Format_Grayscale8)
+        self.metrics.measure("convert", started)
+        return image
+
+    def get_content_layer(self, index):
+        return DocumentPool.LAYER_CONTENT if self.layered and not self.is_blended(index) else DocumentPool.LAYER_ALL
+
+    def is_blended(self, index):
+        # Annotations (or widgets) with a blend mode other than Normal or
+        # with transparency groups are not drawn right over the content
+        # apart from it: those pages are rendered with their annotations
+        page_id = self.get_page_id(index)
+        if page_id not in self.blended_pages:
+            page, document = self.document[index], self.document
+            pending, seen, blended = [], set(), False
+            for xref in [annot.xref for annot in page.annots()] + [widget.xref for widget in page.widgets()]:
+                pending += ["/BM " + document.xref_get_key(xref, "BM")[1], document.xref_get_key(xref, "AP")[1]]
+
+            # The appearance streams and what they use
+            while pending and not blended:
+                source = pending.pop()
+                modes = re.findall(r"/BM\s*\[?\s*/(\w+)", source)
+                blended = any(mode not in ["Normal", "Compatible"] for mode in modes) or "/Transparency" in source
+                for xref in re.findall(r"(\d+) \d+ R", source):
+                    if xref not in seen:
+                        seen.add(xref)
+                        pending.append(document.xref_object(int(xref), compressed=True))
+            self.blended_pages[page_id] = blended
+        return self.blended_pages[page_id]
+
+    def get_annotations_rect(self, index):
+        # Area covered by the annotations and widgets, None if there
+        # are none or if they are rendered with the content
+        if self.get_content_layer(index) == DocumentPool.LAYER_ALL:
+            return None
+        page_id = self.get_page_id(index)
+        if page_id not in self.annotation_rects:
+            bbox = get_annotations_bbox(self.document[index])
+            self.annotation_rects[page_id] = None if bbox.is_empty else fitz_rect_to_qrectf(bbox)
+        return self.annotation_rects[page_id]
+
+    def get_annotations_area(self, index, ratio):
+        # The same rect in pixels, as the image of the annotations covers it
+        rect = self.get_annotations_rect(index)
+        if rect is None:
+            return None
+        return QRectF(rect.x() * ratio, rect.y() * ratio, rect.width() * ratio, rect.height() * ratio).toAlignedRect()
+
+    def get_page_version(self, page_id):
+        return self.page_versions.get(page_id, 0)
+
+    def patch_images(self, index, rect, tile_size):
+        # Renders again only the area (in page coordinates) changed by an
+        # edit and draws it over the cached images and tiles of the page.
+        # Returns False if the whole page has to be rendered again instead
+        page = self.document[index]
+        w, h = self.get_page_size(index)
+        rect = rect.adjusted(-1, -1, 1, 1).intersected(QRectF(0, 0, w, h))
+        if page.rotation != 0 or rect.width() * rect.height() > w * h * self.PATCH_MAX_AREA:
+            return False
+
+        self.touch_page(index)
+        if rect.isEmpty():
+            return True
+
+        page_id = self.get_page_id(index)
+        version = self.get_page_version(page_id)
+        patches = {}
+        for key, image in self.cache.get_page_images(page_id):
+            _, ratio, rotation, tile = key
+            # The annotations may have changed too, and the page may have color now
+            if tile in [RenderCache.PREVIEW, RenderCache.ANNOTATIONS] or image.format() != QImage.Format_RGB32:
+                self.cache.discard(key)
+                continue
+
+            origin = QPoint(0, 0) if tile is None else QPoint(tile[0] * tile_size, tile[1] * tile_size)
+            area = QRectF(rect.x() * ratio, rect.y() * ratio, rect.width() * ratio, rect.height() * ratio)
+            if not area.toAlignedRect().intersects(QRect(origin, image.size())):
+                continue
 
-    def set_image(self, index, image, ratio):
-        self.images[index].set_image(image, ratio)
-        self.images[index].loaded = True
+            # One render per ratio and layer, aligned to the pixels of the
+            # images. Tiles are always rendered with the annotations
+            layer = self.get_content_layer(index) if tile is None else DocumentPool.LAYER_ALL
+            if (ratio, layer) not in patches:
+                # The same the render threads are given afterwards
+                display_list = self.documents.get_edited_display_list(self.document, index, page_id, version, layer)
+                area = area.toAlignedRect()
+                clip = Rect(area.x() / ratio, area.y() / ratio, (area.x() + area.width()) / ratio,
+                            (area.y() + area.height()) / ratio)
+                aa_gate.acquire()
+                try:
+                    pix = display_list.get_pixmap(matrix=pymupdf.Matrix(ratio, ratio), clip=clip, alpha=False)
+                finally:
+                    aa_gate.release()
+                patches[ratio, layer] = QPoint(pix.x, pix.y), QImage(pix.samples_mv, pix.width, pix.height, pix.stride,
+                                                             QImage.Format_RGB888).convertToFormat(QImage.Format_RGB32)
+
+            # In pixels, whatever the device pixel ratio of the image
+            position, patch = patches[ratio, layer]
+            painter = QPainter(image)
+            painter.scale(1 / image.devicePixelRatio(), 1 / image.devicePixelRatio())
+            painter.drawImage(position - origin, patch)
+            painter.end()
+        return True
+
+    def set_thumbnail_cache(self, enabled):
+        self.thumbnails_enabled = enabled
+
+    def get_fingerprint(self):
+        # The first element of the ID of the file does not change
+        # when the file is saved, the name is used if there is none
+        if self.fingerprint is None:
+            kind, value = self.document.xref_get_key(-1, "ID")
+            if kind == "array" and "<" in value:
+                source = value.strip("[]").split(">")[0].strip("<")
+            else:
+                source = os.path.abspath(self.filename)
+            self.fingerprint = hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+        return self.fingerprint
+
+    def get_page_hash(self, index, layer):
+        # Called from the render threads, for the pages as in the file
+        # they read. Depends only on what the page shows, not on the
+        # object numbers or the compression, which change when saved
+        document = self.documents.get_document()
+        page = document[index]
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((layer, page.rotation, tuple(page.cropbox), tuple(page.mediabox))).encode())
+        for xref in page.get_contents():
+            digest.update(document.xref_stream(xref))
+
+        # The images, forms and fonts the content draws, the
+        # resources possibly inherited from the page tree
+        memo, xref = {}, page.xref
+        while xref:
+            kind, value = document.xref_get_key(xref, "Resources")
+            if kind != "null":
+                digest.update(self.replace_references(document, value, memo).encode())
+                break
+            kind, value = document.xref_get_key(xref, "Parent")
+            xref = int(value.split()[0]) if kind == "xref" else 0
+
+        for annot in page.annots():
+            digest.update(repr((annot.type, tuple(annot.rect), annot.colors, annot.info["content"])).encode())
+        for widget in page.widgets():
+            digest.update(repr((widget.field_name, widget.field_value)).encode())
+        return digest.hexdigest()
+
+    def replace_references(self, document, source, memo):
+        return re.sub(r"(\d+) \d+ R", lambda m: self.get_object_digest(document, int(m.group(1)), memo).hex(),
+                      source)
+
+    def get_object_digest(self, document, xref, memo):
+        # What the object holds, its references replaced by the digests
+        # of the objects they point to (recursively, e.g. the forms):
+        # the same for the same resources whatever their object numbers
+        if xref not in memo:
+            # Until computed, for the cycles
+            memo[xref] = b""
+            digest = hashlib.blake2b(digest_size=16)
+            keys = document.xref_get_keys(xref)
+            for key in keys:
+                if key not in self.UNHASHED_KEYS:
+                    value = document.xref_get_key(xref, key)[1]
+                    digest.update(self.replace_references(document, "/" + key + " " + value, memo).encode())
+            if not keys:
+                digest.update(self.replace_references(document, document.xref_object(xref, compressed=True),
+                                                      memo).encode())
+            if document.xref_is_stream(xref):
+                digest.update(document.xref_stream(xref))
+            memo[xref] = digest.digest()
+        return memo[xref]
+
+    def use_thumbnail_cache(self):
+        # Never store on disk the content of protected documents
+        return self.thumbnails_enabled and self.document.is_pdf and not self.document.is_encrypted \
+            and self.password is None
+
+    def load_thumbnail(self, index, ratio, fingerprint, page_hash):
+        # Called from the render threads
+        image = self.thumbnails.load(fingerprint, page_hash)
+        if image is None:
+            return None
+
+        # Scaled down if bigger, rendered again if too small
+        width = round(self.documents.get_document()[index].rect.width * ratio)
+        if image.width() < width * 0.9:
+            return None
+        if image.width() != width:
+            image = image.scaledToWidth(width, Qt.SmoothTransformation)
+        return image
+
+    def save_thumbnail(self, fingerprint, page_hash, image):
+        # Called from the render threads
+        self.thumbnails.save(fingerprint, page_hash, image)
 
     def get_num_of_pages(self):
         return len(self.document) if self.document else 0
 
+    def get_generation(self):
+        return self.generation
+
     def get_max_pages_size(self):
-        return self.max_width, self.max_height
+        return self.geometry.get_max_size()
 
-    def set_document(self, document, emit):
+    def set_document(self, document, emit, pristine=False, geometry=None):
         self.document_about_to_change.emit()
+
+        # Page ids are only meaningful within the same document
+        if document is not self.document:
+            self.cache.clear()
+            self.page_versions.clear()
+
+            # A pristine document is rendered straight from its file, and
+            # so is a copy (see copy_document) from its temporary file
+            self.documents.reset(document, document.name if pristine else None, self.password,
+                                 snapshot=pristine and document.name != self.filename)
+
+        # Whatever was requested before is meaningless now
+        self.generation += 1
+        self.service.cancel_all()
+        self.fingerprint = None
+        self.annotation_rects.clear()
+        self.blended_pages.clear()
+        self.gray_pages.clear()
+        self.fields_index = None
+
+        # The geometry of the pages of the same document
+        # is kept up to date by the methods that change it
+        if geometry is not None:
+            self.geometry = geometry
+        elif document is not self.document or len(self.geometry) != len(document):
+            self.geometry.fill(document)
+
         self.document = document
-        self.images.clear()
-        self.mutex.clear()
-        self.max_width = 0
-        self.max_height = 0
-
-        for i in range(self.get_num_of_pages()):
-            w, h = self.get_page_size(i)
-            self.max_width = max(self.max_width, w)
-            self.max_height = max(self.max_height, h)
-            self.images.append(Image(w, h))
-            self.mutex.append(QMutex())
 
         if emit:
             self.document_changed.emit()
 
-    def process_request_queue(self):
-        for index, ratio in self.request_queue.items():
-            self.load(index, ratio, True)
-        # self.request_queue.clear()
-
-    def request_image(self, index, ratio, force=False):
-        # print("Requesting image", index, ratio, force)
-        if not self.images[index].loaded or force:
-            self.load(index, ratio, force)
-        elif self.images[index].ratio != ratio:
-            self.request_queue_timer.stop()
-            self.request_queue_timer.start(100)
-            self.request_queue[index] = ratio
-
-    def get_image(self, index, ratio):
-        return self.images[index].get_image(ratio)
-
-    def render_page(self, index, ratio):
+    def set_render_backend(self, backend):
+        if backend == self.BACKEND_PROCESSES:
+            self.processes.start()
+        else:
+            self.processes.stop()
+
+    def set_progressive(self, value):
+        self.progressive = value
+
+    def is_progressive(self):
+        return self.progressive
+
+    def render_page(self, index, ratio, preview=False, display_list=None, layer=DocumentPool.LAYER_ALL):
+        return self.render_area(index, ratio, preview=preview, layer=layer, display_list=display_list)
+
+    def render_tile(self, index, ratio, rect, display_list=None):
+        clip = Rect(rect.x(), rect.y(), rect.x() + rect.width(), rect.y() + rect.height())
+        return self.render_area(index, ratio, clip, display_list=display_list)
+
+    def render_annotations(self, index, ratio, area, display_list=None):
+        # The area is in pixels, see get_annotations_area()
+        clip = Rect(area.x() / ratio, area.y() / ratio, (area.x() + area.width()) / ratio,
+                    (area.y() + area.height()) / ratio)
+        return self.render_area(index, ratio, clip, layer=DocumentPool.LAYER_ANNOTATIONS, display_list=display_list)
+
+    def render_area(self, index, ratio, clip=None, preview=False, layer=DocumentPool.LAYER_ALL, display_list=None):
+        # Called from the render threads, the index is the one of the page
+        # in the file they read unless the display list of an edited page
+        # is given. Tiny documents are always rendered in the threads
+        # themselves, and so are the annotations and the edited pages
+        aa_level = self.PREVIEW_AA_LEVEL if preview else None
+        alpha = layer == DocumentPool.LAYER_ANNOTATIONS
+        if display_list is None and not alpha and self.processes.is_running() \
+                and self.get_num_of_pages() >= ProcessRenderer.MIN_PAGES:
+            # Rasterisation, transfer and conversion together
+            started = time.perf_counter()
+            image = self.processes.render(index, ratio, clip, aa_level, layer)
+            self.metrics.measure("raster", started)
+            if image is not None:
+                return image
+
+        # Each thread uses its own document, the display list is shared
         mat = pymupdf.Matrix(ratio, ratio)
-        pix = self.get_document()[index].get_pixmap(matrix=mat, alpha=False, annots=True)
-        return QPixmap.fromImage(QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format_RGB888))
+        started = time.perf_counter()
+        if display_list is None:
+            display_list = self.documents.get_display_list(index, layer)
+        aa_gate.acquire(aa_level)
+        try:
+            pix = display_list.get_pixmap(matrix=mat, clip=clip, alpha=alpha)
+        finally:
+            aa_gate.release()
+        self.metrics.measure("raster", started)
+
+        # Wrap the samples without copying them and convert them,
+        # once, to the format QPainter draws without conversion
+        started = time.perf_counter()
+        if alpha:
+            image = QImage(pix.samples_mv, pix.width, pix.height, pix.stride,
+                           QImage.Format_RGBA8888_Premultiplied).convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        else:
+            image = QImage(pix.samples_mv, pix.width, pix.height, pix.stride, QImage.Format_RGB888).convertToFormat(
+                QImage.Format_RGB32)
+        self.metrics.measure("convert", started)
+        return image
+
+    def request_page(self, index, ratio, generation, signals, priority=RenderRequest.PRIORITY_VISIBLE,
+                     preview=False, gray=False, thumbnail=False):
+        page_id = self.get_page_id(index)
+        version = self.get_page_version(page_id)
+        layer = self.get_content_layer(index)
+        display_list = self.documents.get_edited_display_list(self.document, index, page_id, version, layer)
+
+        # The edited pages are not looked up on disk, they are not as in the file
+        fingerprint = None
+        if thumbnail and display_list is None and self.use_thumbnail_cache():
+            fingerprint = self.get_fingerprint()
+        return self.service.request(RenderRequest(self.generation, page_id, index, ratio, generation, signals,
+                                                  preview=preview, priority=priority, version=version, gray=gray,
+                                                  display_list=display_list, fingerprint=fingerprint, layer=layer))
+
+    def request_preview(self, index, ratio, generation, signals, priority=RenderRequest.PRIORITY_VISIBLE,
+                        gray=False):
+        return self.request_page(index, ratio, generation, signals, priority, True, gray)
+
+    def request_annotations(self, index, ratio, generation, signals, priority=RenderRequest.PRIORITY_VISIBLE):
+        page_id = self.get_page_id(index)
+        version = self.get_page_version(page_id)
+        display_list = self.documents.get_edited_display_list(self.document, index, page_id, version,
+                                                              DocumentPool.LAYER_ANNOTATIONS)
+        return self.service.request(RenderRequest(self.generation, page_id, index, ratio, generation, signals,
+                                                  rect=self.get_annotations_area(index, ratio), priority=priority,
+                                                  version=version, annotations=True, display_list=display_list))
+
+    def request_tiles(self, index, ratio, tiles, generation, signals, priority=RenderRequest.PRIORITY_VISIBLE,
+                      gray=False):
+        # Tiles are independent, render them in parallel
+        page_id, version = self.get_page_id(index), self.get_page_version(self.get_page_id(index))
+        display_list = self.documents.get_edited_display_list(self.document, index, page_id, version,
+                                                              DocumentPool.LAYER_ALL)
+        return [self.service.request(RenderRequest(self.generation, page_id, index, ratio, generation, signals,
+                                                   key, rect, priority=priority, version=version, gray=gray,
+                                                   display_list=display_list))
+                for key, rect in tiles]
 
     def render_image(self, index, ratio):
         mat = pymupdf.Matrix(ratio, ratio)
-        pix = self.get_document()[index].get_pixmap(matrix=mat, alpha=False, annots=True)
+        aa_gate.acquire()
+        try:
+            pix = self.get_document()[index].get_pixmap(matrix=mat, alpha=False, annots=True)
+        finally:
+            aa_gate.release()
         return QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format_RGB888)
 
-    def load(self, index, ratio, force):
-        class Loader(QRunnable):
-            def __init__(self, renderer: MuPDFRenderer, index, ratio, mutex):
-                super().__init__()
-                self.renderer = renderer
-                self.index = index
-                self.ratio = ratio
-                self.force = force
-
-            def get_pixmap(self):
-                mat = pymupdf.Matrix(self.ratio, self.ratio)
-
-                pix = self.renderer.get_document()[self.index].get_pixmap(matrix=mat, alpha=False, annots=True)
-                image = QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format_RGB888)
-
-                # pixmap = QPixmap.fromImage(image)
-                self.renderer.set_image(index, image, ratio)
-                self.renderer.image_ready.emit(self.index, self.ratio, image)
-
-            def run(self):
-                image = self.renderer.images[self.index]
-                if self.force:
-                    self.get_pixmap()
-                    # print("get pixmap1")
-                elif image.ratio == self.ratio and image.loaded:
-                    # print("As is ", self.index, self.key)
-                    self.renderer.image_ready.emit(self.index, self.ratio, image.image)
-                elif image.ratio > self.ratio and image.loaded:
-                    # print("Scaling down ", self.index, self.key)
-                    pixmap = image.image.scaledToWidth(int(image.w * ratio), QtCore.Qt.SmoothTransformation)
-                    self.renderer.image_ready.emit(self.index, self.ratio, pixmap)
-                else:
-                    # print("get pixmap2")
-                    self.get_pixmap()
-
-        loader = Loader(self, index, ratio, self.mutex[index])
-        self.h.start(loader)
-
     def get_document(self):
         return self.document
 
@@ -394,6 +915,7 @@ class MuPDFRenderer(QLabel):
 
     def rearrange_pages(self, order, emit):
         self.document.select(order)
+        self.geometry.rearrange(order)
         self.set_document(self.document, emit)
 
     def set_cropbox(self, page, rect: QRect, absolute=False):
@@ -413,15 +935,14 @@ class MuPDFRenderer(QLabel):
                                              min(x + cx + w, mx2),
                                              min(y + cy + h, my2)) * self.document[
                                             page].derotation_matrix)
-        w, h = self.get_page_size(page)
-        self.images[page].update(w, h)
+        self.geometry.update(page, self.document[page])
+        self.invalidate_images(page)
         self.page_updated.emit(page)
 
         return True
 
     def get_cropbox(self, page):
-        x0, y0 = self.document[page].cropbox.x0, self.document[page].cropbox.y0
-        x1, y1 = self.document[page].cropbox.x1, self.document[page].cropbox.y1
+        x0, y0, x1, y1 = self.geometry.get_cropbox(page)
         return QRectF(x0, y0, x1 - x0, y1 - y0)
 
     def add_redact_annot(self, index, rect, color=None, minimize=False, apply=True):
@@ -432,9 +953,17 @@ class MuPDFRenderer(QLabel):
         rect = utils.qrectf_to_fitz_rect(rect)
         if color is not None:
             color = utils.qcolor_to_fitz_color(QColor(color))
+
+        # Text and drawings touching the rect are removed as a whole
+        area = Rect(rect)
+        for kind, bbox in page.get_bboxlog():
+            if kind.startswith(("fill", "stroke")) and Rect(bbox).intersects(rect):
+                area |= bbox
+
         page.add_redact_annot(rect, fill=color)
         if apply:
             page.apply_redactions(1)
+        return fitz_rect_to_qrectf(area)
 
     def apply_redactions(self, index):
         self.document[index].apply_redactions()
@@ -459,17 +988,23 @@ class MuPDFRenderer(QLabel):
         fitz_annot.set_opacity(color.alpha() / 255 if stroke is not None else 0.0)
 
         fitz_annot.update()
+        if self.dynamic_annots is not None:
+            self.dynamic_annots.append((index, fitz_annot.xref))
+        return fitz_rect_to_qrectf(fitz_annot.rect)
 
     def uncrop(self, index):
         self.document[index].set_cropbox(self.document[index].mediabox)
+        self.geometry.update(index, self.document[index])
+        self.invalidate_images(index)
         self.page_updated.emit(index)
 
     def is_cropped(self, index):
-        return self.document[index].cropbox != self.document[index].mediabox
+        return self.geometry.is_cropped(index)
 
     def get_annotations(self, index):
 
         annots = list()
+        removed = False
         for annot in self.document[index].annots():  # type: Annot
 
             if annot.type[0] == PDF_ANNOT_SQUARE:
@@ -495,6 +1030,7 @@ class MuPDFRenderer(QLabel):
 
                 annots.append(swik_annot)
                 self.document[index].delete_annot(annot)
+                removed = True
             elif annot.type[0] == PDF_ANNOT_HIGHLIGHT:
                 color = utils.fitz_color_to_qcolor(annot.colors["stroke"], annot.opacity)
                 # print(annot.colors, annot.opacity)
@@ -512,6 +1048,7 @@ class MuPDFRenderer(QLabel):
                         swik_annot.add_quad(quad)
                 annots.append(swik_annot)
                 self.document[index].delete_annot(annot)
+                removed = True
 
             '''
             elif a.type[0] == fitz.PDF_ANNOT_HIGHLIGHT:
@@ -549,6 +1086,9 @@ class MuPDFRenderer(QLabel):
                 annots.append(annot)
                 self.document[index].delete_annot(a)
             '''
+        # Now shown as items, not in the page image
+        if removed:
+            self.invalidate_annotations(index)
         return annots
 
     def add_annot(self, index, annot):
@@ -566,6 +1106,10 @@ class MuPDFRenderer(QLabel):
             fitz_annot.set_opacity(opacity)
             fitz_annot.set_info(None, annot.get_content(), "", "", "", "")
             fitz_annot.update()
+            if self.dynamic_annots is not None:
+                self.dynamic_annots.append((index, fitz_annot.xref))
+            return fitz_rect_to_qrectf(fitz_annot.rect)
+        return None
 
     def add_text(self, index, item: SwikText):
         self.document[index].clean_contents()
@@ -606,13 +1150,38 @@ class MuPDFRenderer(QLabel):
         else:
             tw.fill_textbox(rect, item.get_text(), font=font, fontsize=item.font().pointSizeF() * 96 / 72)
             tw.write_text(self.document[index])
+
+        # Glyphs can go a bit beyond the box
+        return fitz_rect_to_qrectf(tw.text_rect | rect).adjusted(-2, -2, 2, 2)
         # page: pymupdf.Page = self.document[index]
         # page.draw_rect(rect, color=(1, 0, 0), width=1)
 
     def replace_word(self, index, text: SwikTextReplace):
         self.document[index].clean_contents()
-        self.add_redact_annot(index, text.get_rect_on_parent(), minimize=True)
-        self.add_text(index, text)
+        area = self.add_redact_annot(index, text.get_rect_on_parent(), minimize=True)
+        return area.united(self.add_text(index, text))
+
+    def has_widgets(self):
+        # Without loading the pages
+        return bool(self.document.is_form_pdf)
+
+    def get_fields_index(self):
+        # Page index -> xrefs of its widgets, read from the /Annots
+        # of the pages without loading them (see ToolForm)
+        if self.fields_index is None:
+            self.fields_index = {}
+            if self.has_widgets():
+                for index in range(self.get_num_of_pages()):
+                    kind, annots = self.document.xref_get_key(self.document.page_xref(index), "Annots")
+                    if kind == "xref":
+                        annots = self.document.xref_object(int(annots.split()[0]), compressed=True)
+                    elif kind != "array":
+                        continue
+                    xrefs = [int(xref) for xref in re.findall(r"(\d+) 0 R", annots)]
+                    xrefs = [xref for xref in xrefs if self.document.xref_get_key(xref, "Subtype")[1] == "/Widget"]
+                    if len(xrefs) > 0:
+                        self.fields_index[index] = xrefs
+        return self.fields_index
 
     def get_widgets(self, index):
         doc_page = self.document[index]
@@ -685,12 +1254,30 @@ class MuPDFRenderer(QLabel):
                     field.field_value = value
                     field.update()
 
-                return
+                return fitz_rect_to_qrectf(field.rect)
+        return None
+
+    def copy_document(self):
+        # Through a temporary file instead of tobytes(): the copy
+        # reads the pages when needed, as the document opened from
+        # the file, and never holds the whole file in memory
+        fd, filename = tempfile.mkstemp(prefix="swik_", suffix=".pdf")
+        os.close(fd)
+        self.document.save(filename, encryption=PDF_ENCRYPT_KEEP, deflate=True, garbage=3)
+
+        # The objects are renumbered by the save, the
+        # file cannot be appended to from now on
+        self.source_stat = None
+        document = pymupdf.open(filename)
+        if document.needs_pass and self.password is not None:
+            document.authenticate(self.password)
+
+        # Kept for the render threads, which open it as well, and
+        # removed once replaced (see set_document and DocumentPool)
+        return document
 
     def sanitize(self):
-        clean_doc_data = self.document.tobytes(encryption=PDF_ENCRYPT_KEEP, deflate=True, garbage=3)
-        clean_doc = pymupdf.open("pdf", clean_doc_data)
-        return clean_doc
+        return self.copy_document()
 
     def flatten(self, filename):
 
@@ -700,7 +1287,7 @@ class MuPDFRenderer(QLabel):
         # Sanitize the document that is gonna be
         # flattened, establish it as the current
         # document (necessary for sync_request)
-        self.set_document(self.sanitize(), False)
+        self.set_document(self.sanitize(), False, pristine=True)
 
         # Prepare for baking
         self.sync_requested.emit()
@@ -718,11 +1305,10 @@ class MuPDFRenderer(QLabel):
         return self.FLATTEN_OK
 
     def save_elsewhere(self, filename):
-        current_doc_data = self.document.tobytes(encryption=PDF_ENCRYPT_KEEP, deflate=True, garbage=3)
+        current_doc = self.copy_document()
         self.sync_requested.emit()
         self.document.save(filename, encryption=PDF_ENCRYPT_KEEP, deflate=True, garbage=3)
-        current_doc = pymupdf.open("pdf", current_doc_data)
-        self.set_document(current_doc, False)
+        self.set_document(current_doc, False, pristine=True)
 
     def save_fonts(self, out_dir):
         font_xrefs = set()
@@ -751,6 +1337,8 @@ class MuPDFRenderer(QLabel):
         self.document.insert_pdf(doc2)
         page_count = len(doc2)
         doc2.close()
+        for index in range(len(self.document) - page_count, len(self.document)):
+            self.geometry.insert(index, self.document[index])
         self.set_document(self.document, False)
         # print("Appended", page_count, "pages", len(self.document))
         return page_count
@@ -768,6 +1356,11 @@ class MuPDFRenderer(QLabel):
 
     def insert_blank_page(self, index, width, height):
         self.document.new_page(index, width=width, height=height)
+        self.geometry.insert(index, self.document[index])
+
+        # The pages after it have moved
+        self.generation += 1
+        self.service.cancel_all()
 
     def insert_image(self, index, rect, qimage):
         self.document[index].clean_contents()
@@ -780,11 +1373,13 @@ class MuPDFRenderer(QLabel):
         # Create a fitz.Pixmap from the bytes
         pixmap = pymupdf.Pixmap(byte_array.data())
         self.document[index].insert_image(rect, pixmap=pixmap)
+        return fitz_rect_to_qrectf(rect)
 
     def insert_image_from_file(self, index, rect, filename):
         self.document[index].clean_contents()
         rect = Rect(rect.x(), rect.y(), rect.x() + rect.width(), rect.y() + rect.height())
         self.document[index].insert_image(rect, filename=filename, keep_proportion=False)
+        return fitz_rect_to_qrectf(rect)
 
     def insert_image2(self, index, rect, qimage):
         rect = pymupdf.Rect(rect.x(), rect.y(), rect.x() + rect.width(), rect.y() + rect.height())
@@ -799,10 +1394,13 @@ class MuPDFRenderer(QLabel):
 
     def append_blank_page(self, width=595, height=842):
         self.document.new_page(-1, width=width, height=height)
+        self.geometry.insert(len(self.document) - 1, self.document[-1])
         self.set_document(self.document, False)
 
     def rotate_page(self, index, angle):
         self.document[index].set_rotation(self.document[index].rotation + angle)
+        self.geometry.update(index, self.document[index])
+        self.touch_page(index)
         self.set_document(self.document, False)
 
     def get_links(self, index):
@@ -823,8 +1421,8 @@ class MuPDFRenderer(QLabel):
             if pdf_link.is_external:
                 link = ExternalLink(rect, pdf_link.uri)
             else:
-                index, x, y = self.document.resolve_link(pdf_link.uri)
-                link = InternalLink(rect, (index, x, y))
+                # Resolved when the link is used
+                link = InternalLink(rect, lambda uri=pdf_link.uri: self.document.resolve_link(uri))
 
             links.append(link)
             pdf_link = pdf_link.next
@@ -1,11 +1,14 @@
+import math
 import typing
 
-from PyQt5.QtCore import Qt, QRectF, pyqtSignal, QObject, QMutex, QTimer
-from PyQt5.QtGui import QBrush, QColor, QTransform, QPixmap
+from PyQt5.QtCore import Qt, QRectF, pyqtSignal, QObject, QMutex, QTimer, QPointF, QPoint
+from PyQt5.QtGui import QBrush, QColor, QTransform, QImage, QPainter
 from PyQt5.QtWidgets import QWidget, QGraphicsView, QGraphicsRectItem, QGraphicsItem, QGraphicsEllipseItem
 
 from swik import utils
 from swik.annotations.hyperlink import InternalLink
+from swik.render_cache import RenderCache
+from swik.render_service import RenderRequest
 
 
 class SimplePage(QGraphicsRectItem):
@@ -16,6 +19,25 @@ class SimplePage(QGraphicsRectItem):
     STATE_FORCED = 4
     STATE_IMAGE_REQUESTED = 5
 
+    # Tiled rendering: pages whose image would be bigger than
+    # TILE_THRESHOLD pixels are rendered as TILE_SIZE x TILE_SIZE
+    # tiles covering only the part of the page that is on screen
+    TILE_SIZE = 512
+    TILE_THRESHOLD = 2048 * 2048
+
+    # Progressive rendering: pages without any image get first
+    # a quick low quality preview at PREVIEW_SCALE times the ratio
+    PREVIEW_SCALE = 0.25
+
+    # Priority class of the render requests of the page
+    RENDER_PRIORITY = RenderRequest.PRIORITY_VISIBLE
+
+    # Keep the images of the pages without color in 8 bits per pixel
+    GRAYSCALE = False
+
+    # Look the images up in the thumbnail cache on disk (and store them)
+    THUMBNAILS = False
+
     class Shadow(QGraphicsRectItem):
         pass
 
@@ -23,7 +45,10 @@ class SimplePage(QGraphicsRectItem):
         pass
 
     class Signals(QObject):
-        image_prepared = pyqtSignal(QPixmap, float)
+        image_prepared = pyqtSignal(QImage, float, int)
+        preview_prepared = pyqtSignal(QImage, float, int)
+        annotations_prepared = pyqtSignal(QImage, float, int)
+        tile_prepared = pyqtSignal(int, int, int, float, QImage)
 
     def __init__(self, index, view: QGraphicsView, manager, renderer, ratio):
         super().__init__()
@@ -35,15 +60,18 @@ class SimplePage(QGraphicsRectItem):
         self.renderer = renderer
         self.signals2 = SimplePage.Signals()
         self.signals2.image_prepared.connect(self.image_ready)
+        self.signals2.preview_prepared.connect(self.preview_ready)
+        self.signals2.annotations_prepared.connect(self.annotations_ready)
+        self.signals2.tile_prepared.connect(self.tile_ready)
         # self.renderer.image_ready.connect(self.image_ready)
         self.ratio = ratio
         self.view = view
         self.state = SimplePage.STATE_INVALID
-        self.image = None
         self.w, self.h = self.renderer.get_page_size(index)
 
         self.setRect(QRectF(0, 0, self.w, self.h))
         self.setAcceptTouchEvents(True)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
 
         self.setBrush(Qt.white)
         self.setPen(Qt.transparent)
@@ -72,12 +100,37 @@ class SimplePage(QGraphicsRectItem):
         self.request_image_timer.setSingleShot(True)
         self.request_image_timer.timeout.connect(self.process_requested_image)
         self.requested_image_ratio = 1
-        self.image_ratio = 0
+        self.pending_request = None
+        self.preview_request = None
+        self.annotations_request = None
+        self.generation = 0
+        self.tiles_ratio = 0
+        self.requested_tiles = {}
         self.setTransform(QTransform(ratio, 0, 0, 0, ratio, 0, 0, 0, 1))
-        self.original_info = {"page": index}
+        self.own_items = set()
+
+    def set_own_items(self):
+        # The items the page is created with
+        self.own_items = set(self.childItems())
+
+    def is_disposable(self):
+        # Released by the view when far from the viewport (see
+        # GraphView.update_pages) only if nothing would be lost
+        return set(self.childItems()) <= self.own_items
+
+    def read_items(self):
+        # Nothing but the image (see Page)
+        pass
+
+    def release(self):
+        self.request_image_timer.stop()
+        requests = [self.pending_request, self.preview_request, self.annotations_request]
+        for request in requests + list(self.requested_tiles.values()):
+            if request is not None:
+                request.cancelled = True
 
     def update_original_info(self, info):
-        self.original_info.update(info)
+        self.view.update_original_info(self.index, info)
 
     def shine(self, color=QColor(0, 255, 0, 60), delay=1000):
         visible, brush = self.box.isVisible(), self.box.brush()
@@ -91,7 +144,7 @@ class SimplePage(QGraphicsRectItem):
         QTimer.singleShot(delay, restore)
 
     def get_original_info(self):
-        return self.original_info
+        return self.view.get_original_info(self.index)
 
     def get_index(self):
         return self.index
@@ -126,42 +179,288 @@ class SimplePage(QGraphicsRectItem):
     def get_scaling_ratio(self):
         return self.transform().m11()
 
+    def get_device_pixel_ratio(self):
+        return self.view.viewport().devicePixelRatioF()
+
+    def get_render_ratio(self):
+        # Pixels of the screen per point of the page: rendered
+        # at this ratio the images are drawn without scaling
+        return self.ratio * self.get_device_pixel_ratio()
+
+    def use_grayscale(self):
+        # The main view only in low memory mode: grayscale
+        # images are converted every time they are painted
+        return self.GRAYSCALE or self.renderer.is_low_memory()
+
+    def set_image(self, image, ratio, tile=None):
+        image.setDevicePixelRatio(self.get_device_pixel_ratio())
+        self.renderer.set_image(self.index, image, ratio, tile)
+
     def request_image(self, ratio, now=False):
         self.requested_image_ratio = ratio
         self.request_image_timer.stop()
         self.request_image_timer.start(200 if not now else 5)
 
+    def request_preview(self, ratio, force=False):
+        if (self.renderer.is_progressive() or force) and (self.preview_request is None or self.preview_request.cancelled):
+            self.preview_request = self.renderer.request_preview(self.index, ratio * self.PREVIEW_SCALE,
+                                                                 self.generation, self.signals2, self.RENDER_PRIORITY,
+                                                                 self.use_grayscale())
+
+    def request_annotations(self, ratio):
+        request = self.annotations_request
+        if request is not None and request.is_pending():
+            if request.ratio == ratio:
+                return
+            request.cancelled = True
+        self.annotations_request = self.renderer.request_annotations(self.index, ratio, self.generation, self.signals2,
+                                                                     self.RENDER_PRIORITY)
+
+    def prefetch(self):
+        # Image the page will need when shown, tiled pages get the preview
+        ratio = self.get_render_ratio()
+        ratio = self.get_preview_ratio(ratio) if self.is_tiled(ratio) else ratio
+        if self.renderer.get_cached_image(self.index, ratio) is not None:
+            return None
+        return self.renderer.request_page(self.index, ratio, self.generation, self.signals2,
+                                          RenderRequest.PRIORITY_PREFETCH, gray=self.use_grayscale(),
+                                          thumbnail=self.THUMBNAILS)
+
     def process_requested_image(self):
+        # Asked again when the user stops scrolling or zooming
+        if self.view.is_interacting():
+            return
+
+        # Rendered in background, the result arrives through image_prepared
+        pending = self.pending_request
+        if pending is not None and pending.is_pending():
+            if pending.ratio == self.requested_image_ratio:
+                return
+            # The zoom has changed meanwhile
+            pending.cancelled = True
+
         if self.isShown():
-            image = self.renderer.render_page(self.index, self.requested_image_ratio)
-            self.image_ready(image, self.requested_image_ratio)
+            self.pending_request = self.renderer.request_page(self.index, self.requested_image_ratio, self.generation,
+                                                              self.signals2, self.RENDER_PRIORITY,
+                                                              gray=self.use_grayscale(), thumbnail=self.THUMBNAILS)
+
+    def is_tiled(self, ratio):
+        return self.w * self.h * ratio * ratio > self.TILE_THRESHOLD
+
+    def get_preview_ratio(self, ratio):
+        # Largest ratio at which the whole page stays below the tiling threshold
+        return min(ratio, math.sqrt(self.TILE_THRESHOLD / (self.w * self.h)))
+
+    def get_exposed_rect(self, painter, option, widget):
+        exposed = option.exposedRect.intersected(self.rect())
+        if isinstance(widget, QWidget):
+            # Only the part of the page that is actually inside the viewport
+            inverted, ok = painter.worldTransform().inverted()
+            if ok:
+                exposed = exposed.intersected(inverted.mapRect(QRectF(widget.rect())))
+        return exposed
+
+    def get_tiles(self, rect, ratio):
+        size = self.TILE_SIZE / ratio
+        tiles = []
+        for row in range(int(rect.top() // size), int(math.ceil(rect.bottom() / size))):
+            for col in range(int(rect.left() // size), int(math.ceil(rect.right() / size))):
+                tile = QRectF(col * size, row * size, size, size).intersected(self.rect())
+                if not tile.isEmpty():
+                    tiles.append(((col, row), tile))
+        return tiles
+
+    def paint_tiles(self, painter, option, widget, ratio):
+        if self.tiles_ratio != ratio:
+            for request in self.requested_tiles.values():
+                request.cancelled = True
+            self.requested_tiles.clear()
+            self.tiles_ratio = ratio
+
+        exposed = self.get_exposed_rect(painter, option, widget)
+        if exposed.isEmpty():
+            return
+
+        # Low resolution version of the whole page
+        # to be shown while the tiles are arriving
+        self.paint_image(painter, exposed, self.get_preview_ratio(ratio))
+
+        # Only the preview while the user scrolls or zooms
+        interacting = self.view.is_interacting()
+        missing = []
+        for key, rect in self.get_tiles(exposed, ratio):
+            tile = self.renderer.get_cached_image(self.index, ratio, key)
+            if tile is not None:
+                col, row = key
+                self.draw_image(painter, rect.intersected(exposed), tile, ratio,
+                                QPoint(col * self.TILE_SIZE, row * self.TILE_SIZE))
+            elif not interacting and (key not in self.requested_tiles or self.requested_tiles[key].cancelled):
+                missing.append((key, rect))
+
+        if len(missing) > 0:
+            requests = self.renderer.request_tiles(self.index, ratio, missing, self.generation, self.signals2,
+                                                   self.RENDER_PRIORITY, self.use_grayscale())
+            for (key, _), request in zip(missing, requests):
+                self.requested_tiles[key] = request
+
+    def tile_ready(self, generation, col, row, ratio, image):
+        # Rendered before the page was invalidated
+        if generation != self.generation:
+            return
+
+        if ratio == self.tiles_ratio:
+            self.requested_tiles.pop((col, row), None)
+        self.set_image(image, ratio, (col, row))
+        self.update()
 
     def paint(self, painter, option, widget: typing.Optional[QWidget] = ...) -> None:
         super().paint(painter, option, widget)
-        if self.image is None or self.ratio != self.image_ratio:
+        ratio = self.get_render_ratio()
+        if self.is_tiled(ratio):
+            self.paint_tiles(painter, option, widget, ratio)
+            return
+
+        # Only the part that needs repainting
+        exposed = self.get_exposed_rect(painter, option, widget)
+        if not exposed.isEmpty():
+            self.paint_image(painter, exposed, ratio)
+
+    def paint_image(self, painter, rect, ratio):
+        # Nothing is allocated for pages without image: the
+        # white background is painted by the rect item itself
+        image, image_ratio = self.renderer.get_cached_image(self.index, ratio), ratio
+        if image is None:
+            # Show the closest image (scaled) until the good one is ready
+            image, image_ratio = self.renderer.get_closest_image(self.index, ratio)
             # print('Requesting image for page', self.index, self.view)
-            self.request_image(self.ratio, self.image is None)
+            if self.view.is_interacting():
+                # Nothing but previews until the user stops (see QualityGovernor)
+                if self.pending_request is not None and self.pending_request.ratio != ratio:
+                    self.pending_request.cancelled = True
+                if image is None:
+                    self.request_preview(ratio, True)
+            else:
+                if image is None:
+                    self.request_preview(ratio)
+                self.request_image(ratio, image is None)
             self.state = SimplePage.STATE_IMAGE_REQUESTED
 
-        if self.image is not None:
-            painter.drawImage(QRectF(0, 0, self.rect().width(), self.rect().height()), self.image.toImage())
+        if image is not None:
+            self.draw_image(painter, rect, image, image_ratio)
+
+        self.paint_annotations(painter, rect, ratio, image_ratio)
+
+    def draw_image(self, painter, rect, image, ratio, offset=QPoint(0, 0)):
+        # Draws the part in rect (page coordinates) of an image of the
+        # page at ratio whose top left corner is at offset (pixels)
+        source = QRectF(rect.x() * ratio - offset.x(), rect.y() * ratio - offset.y(),
+                        rect.width() * ratio, rect.height() * ratio)
+        transform, dpr = painter.worldTransform(), image.devicePixelRatio()
+        if transform.type() > QTransform.TxScale or abs(transform.m11() * dpr - ratio) > 1e-6 \
+                or abs(transform.m22() * dpr - ratio) > 1e-6:
+            # Scaled without filtering while the user scrolls or zooms
+            painter.save()
+            if self.view.is_interacting():
+                painter.setRenderHint(QPainter.SmoothPixmapTransform, False)
+            painter.drawImage(rect, image, source)
+            painter.restore()
+            return
+
+        # One pixel of the image per pixel of the screen: placed
+        # on whole pixels it is just copied, without resampling
+        source = source.toAlignedRect().intersected(image.rect())
+        origin = transform.map(QPointF(0, 0)) * dpr
+        position = QPointF(round(origin.x()) + offset.x() + source.x(), round(origin.y()) + offset.y() + source.y())
+        painter.save()
+        painter.resetTransform()
+        painter.drawImage(position / dpr, image, QRectF(source))
+        painter.restore()
+
+    def paint_annotations(self, painter, rect, ratio, image_ratio):
+        # Annotations are rendered apart from the content of the page
+        # (see MuPDFRenderer.set_layered), so that changing them does
+        # not render the whole page again
+        if self.renderer.get_annotations_rect(self.index) is None:
+            return
+
+        layer, layer_ratio = self.renderer.get_cached_image(self.index, ratio, RenderCache.ANNOTATIONS), ratio
+        if layer is None:
+            if not self.view.is_interacting():
+                self.request_annotations(ratio)
+            # Meanwhile, the ones that go with the image shown
+            if image_ratio is None:
+                return
+            layer, layer_ratio = self.renderer.get_cached_image(self.index, image_ratio,
+                                                                RenderCache.ANNOTATIONS), image_ratio
+            if layer is None:
+                return
+
+        area = self.renderer.get_annotations_area(self.index, layer_ratio)
+        target = QRectF(area.x() / layer_ratio, area.y() / layer_ratio,
+                        area.width() / layer_ratio, area.height() / layer_ratio)
+        exposed = target.intersected(rect)
+        if not exposed.isEmpty():
+            self.draw_image(painter, exposed, layer, layer_ratio, area.topLeft())
 
     def get_image_by_rect(self, rect):
-        return self.image.copy(int(rect.x() * self.image_ratio), int(rect.y() * self.image_ratio), int(rect.width() * self.image_ratio),
-                               int(rect.height() * self.image_ratio))
+        image, image_ratio = self.renderer.get_closest_image(self.index, self.ratio)
+        if image is None:
+            return None
+        return image.copy(int(rect.x() * image_ratio), int(rect.y() * image_ratio), int(rect.width() * image_ratio),
+                          int(rect.height() * image_ratio))
 
-    def image_ready(self, image, ratio):
+    def image_ready(self, image, ratio, generation):
         # print("Image ready for page", self.index, "with state", self.state, "and image", image.width(), "x", image.height())
-        self.image = image
-        self.image_ratio = ratio
+        if self.pending_request is not None and ratio == self.pending_request.ratio:
+            self.pending_request = None
+
+        # Rendered before the page was invalidated
+        if generation != self.generation:
+            return
+
+        self.set_image(image, ratio)
         self.state = SimplePage.STATE_FINAL
         if self.isShown():
             self.update()
 
-    def invalidate(self):
+    def annotations_ready(self, image, ratio, generation):
+        if self.annotations_request is not None and ratio == self.annotations_request.ratio:
+            self.annotations_request = None
+
+        # Rendered before the page was invalidated
+        if generation != self.generation:
+            return
+
+        self.set_image(image, ratio, RenderCache.ANNOTATIONS)
+        if self.isShown():
+            self.update()
+
+    def preview_ready(self, image, ratio, generation):
+        self.preview_request = None
+
+        # Rendered before the page was invalidated
+        if generation != self.generation:
+            return
+
+        self.set_image(image, ratio, RenderCache.PREVIEW)
+        if self.isShown():
+            self.update()
+
+    def invalidate(self, rect=None):
+        # Edits that changed only the given rect are patched
+        # into the images already rendered of the page
+        if rect is not None and self.renderer.patch_images(self.index, rect, self.TILE_SIZE):
+            self.update()
+            return
+
         # print('Invalidating page', self.index)
         self.state = self.STATE_FORCED
-        self.image = None
+        self.renderer.invalidate_images(self.index)
+        self.generation += 1
+        self.pending_request = None
+        self.preview_request = None
+        self.annotations_request = None
+        self.requested_tiles.clear()
         self.w, self.h = self.renderer.get_page_size(self.index)
         self.setRect(QRectF(0, 0, self.w, self.h))
         self.box.setRect(QRectF(0, 0, self.w, self.h))
@@ -46,6 +46,17 @@ class SwikConfig(EasyConfig):
         self.lateral_bar_size = self.general.addCombobox("lateral_bar_size", pretty="Default Miniature Bar Size", items=["Small", "Medium", "Large", "Off"],
                                                          default=0)
 
+        self.performance = self.root().addSubSection("Performance")
+        self.cache_size = self.performance.addInt("cache_size", pretty="Render Cache Size (MB)", default=256)
+        self.render_backend = self.performance.addCombobox("render_backend", pretty="Rendering Backend",
+                                                           items=["Threads", "Processes"], default=0)
+        self.progressive = self.performance.addCheckbox("progressive", pretty="Progressive Rendering", default=True)
+        self.thumbnail_cache = self.performance.addCheckbox("thumbnail_cache", pretty="Keep Thumbnails on Disk",
+                                                            default=True)
+        self.layered = self.performance.addCheckbox("layered", pretty="Render Annotations Separately", default=True)
+        self.low_memory = self.performance.addCheckbox("low_memory", pretty="Low Memory Mode", default=False)
+        self.metrics_log = self.performance.addCheckbox("metrics_log", pretty="Log Render Metrics", default=False)
+
         # encryption = self.root().addSubSection("Encryption")
         # encryption.addString("enc_suffix", pretty="Encrypted File Suffix", default="-enc")
 
@@ -79,6 +90,27 @@ class SwikConfig(EasyConfig):
     def get_default_mode(self):
         return self.mode_on_open.get_value()
 
+    def get_cache_size(self):
+        return self.cache_size.get_value()
+
+    def get_render_backend(self):
+        return self.render_backend.get_value()
+
+    def get_progressive(self):
+        return self.progressive.get_value()
+
+    def get_thumbnail_cache(self):
+        return self.thumbnail_cache.get_value()
+
+    def get_layered(self):
+        return self.layered.get_value()
+
+    def get_low_memory(self):
+        return self.low_memory.get_value()
+
+    def get_metrics_log(self):
+        return self.metrics_log.get_value()
+
     def get_default_bar_width(self):
         return self.lateral_bar_sizes[self.lateral_bar_size.get_value()]
 
@@ -24,8 +24,10 @@ class SwikGraphView(GraphView):
         super(SwikGraphView, self).__init__(manager, renderer, scene, page, mode)
         self.renderer.sync_requested.connect(self.sync_requested)
         self.renderer.sync_dynamic.connect(self.sync_dynamic)
+        self.renderer.annotation_removed.connect(self.annotation_removed)
         self.setAcceptDrops(True)
         self.link_shower = Shower(self.scene())
+        self.page_info = False
 
     def dropEvent(self, event) -> None:
         event.accept()
@@ -48,7 +50,7 @@ class SwikGraphView(GraphView):
 
     def sync_dynamic(self):
         items = self.scene().items()
-        pages_to_refresh = set()
+        pages_to_refresh = {}
 
         square_annot = [item for item in items if type(item) == SquareAnnotation]
         for annot in square_annot:  # type: RedactAnnotation
@@ -58,42 +60,51 @@ class SwikGraphView(GraphView):
         highlight_annot = [item for item in items if type(item) == HighlightAnnotation]
         for annot in highlight_annot:
             page: Page = annot.parentItem()
-            self.renderer.add_highlight_annot(page.index, annot)
-            pages_to_refresh.add(page.get_index())
+            area = self.renderer.add_highlight_annot(page.index, annot)
+            self.add_dirty_area(pages_to_refresh, page.get_index(), area)
 
-        for index in pages_to_refresh:
-            self.pages[index].invalidate()
+        for index, area in pages_to_refresh.items():
+            self.pages[index].invalidate(area)
+
+    def annotation_removed(self, index, area):
+        if (page := self.pages.get(index)) is not None:
+            page.invalidate(area)
+
+    @staticmethod
+    def add_dirty_area(pages_to_refresh, index, area):
+        # Area of each page changed by the edits
+        pages_to_refresh[index] = pages_to_refresh.get(index, QRectF()).united(area)
 
     def sync_requested(self):
         items = self.scene().items()
-        pages_to_refresh = set()
+        pages_to_refresh = {}
 
         redact_annot = [item for item in items if type(item) == RedactAnnotation or type(item) == Patch]
         for annot in redact_annot:  # type: RedactAnnotation
             page: Page = annot.parentItem()
-            self.renderer.add_redact_annot(page.index, annot.get_rect_on_parent(), annot.brush().color())
-            pages_to_refresh.add(page.index)
+            area = self.renderer.add_redact_annot(page.index, annot.get_rect_on_parent(), annot.brush().color())
+            self.add_dirty_area(pages_to_refresh, page.index, area)
             self.scene().removeItem(annot)
 
         swik_text = [item for item in items if type(item) == SwikText]
         for text in swik_text:
             page: Page = text.parentItem()
-            self.renderer.add_text(page.get_index(), text)
-            pages_to_refresh.add(page.get_index())
+            area = self.renderer.add_text(page.get_index(), text)
+            self.add_dirty_area(pages_to_refresh, page.get_index(), area)
             self.scene().removeItem(text)
 
         swik_text_replace = [item for item in items if type(item) == SwikTextReplace]
         for text in swik_text_replace:
             page: Page = text.parentItem()
-            self.renderer.replace_word(page.get_index(), text)
-            pages_to_refresh.add(page.get_index())
+            area = self.renderer.replace_word(page.get_index(), text)
+            self.add_dirty_area(pages_to_refresh, page.get_index(), area)
             self.scene().removeItem(text)
 
         swik_text_numerate = [item for item in items if type(item) == SwikTextNumerate]
         for text in swik_text_numerate:
             page: Page = text.parentItem()
-            self.renderer.add_text(page.get_index(), text)
-            pages_to_refresh.add(page.get_index())
+            area = self.renderer.add_text(page.get_index(), text)
+            self.add_dirty_area(pages_to_refresh, page.get_index(), area)
             self.scene().removeItem(text)
         self.scene().remove_bunches(NumerateBunch)
 
@@ -101,30 +112,37 @@ class SwikGraphView(GraphView):
         for image in images:
             page: Page = image.parentItem()
             if image.get_image_filename() is not None:
-                self.renderer.insert_image_from_file(page.get_index(), image.get_image_rect_on_parent(),
-                                                     image.get_image_filename())
+                area = self.renderer.insert_image_from_file(page.get_index(), image.get_image_rect_on_parent(),
+                                                            image.get_image_filename())
             else:
-                self.renderer.insert_image(page.get_index(), image.get_image_rect_on_parent(), image.get_image())
+                area = self.renderer.insert_image(page.get_index(), image.get_image_rect_on_parent(),
+                                                  image.get_image())
 
-            pages_to_refresh.add(page.get_index())
+            self.add_dirty_area(pages_to_refresh, page.get_index(), area)
             self.scene().removeItem(image)
 
         widgets = [item for item in items if isinstance(item, PdfWidget)]
         for widget in widgets:
             self.renderer.add_widget(widget.parentItem().index, widget)
 
-        for index in pages_to_refresh:
-            self.pages[index].invalidate()
+        for index, area in pages_to_refresh.items():
+            self.pages[index].invalidate(area)
 
     def create_page(self, page, ratio=1):
         page = super().create_page(page, ratio)
+        page.show_visual_info(self.page_info)
         return page
 
+    def can_release_pages(self):
+        # The undo stack refers to the items of the pages
+        return not self.scene().tracker().is_dirty()
+
     def link_hovered(self, kind, page, pos):
 
-        dest_page = self.pages[page]
+        dest_page = self.get_page_item(page)
 
         if kind == InternalLink.ENTER:
+            self.prefetcher.link_hovered(page)
             self.link_shower.enter(dest_page, pos)
 
 
@@ -133,7 +151,7 @@ class SwikGraphView(GraphView):
 
     def link_clicked(self, page, pos):
         # self.move_to_page(page)
-        ellipse = QGraphicsEllipseItem(QRectF(0, 0, 10, 10), self.pages[page])
+        ellipse = QGraphicsEllipseItem(QRectF(0, 0, 10, 10), self.get_page_item(page))
         ellipse.setBrush(QColor(255, 0, 0, 255))
         ellipse.setPen(Qt.transparent)
         ellipse.setPos(pos)
@@ -141,5 +159,6 @@ class SwikGraphView(GraphView):
         utils.delayed(2000, self.scene().removeItem, ellipse)
 
     def toggle_page_info(self):
+        self.page_info = not self.page_info
         for page in self.pages.values():
-            page.toggle_info()
+            page.show_visual_info(self.page_info)
@@ -47,7 +47,6 @@ from swik.tools.tool_redactannotation import ToolRedactAnnotation
 from swik.tools.tool_sign import ToolSign, SignerRectItem
 from swik.tools.tool_squareannotation import ToolSquareAnnotation
 from swik.tools.tool_textselection import ToolTextSelection
-from swik.widgets.pdf_widget import PdfWidget
 
 
 class Splitter(QSplitter):
@@ -185,6 +184,10 @@ class SwikWidget(Shell):
         self.renderer = MuPDFRenderer()
         self.renderer.document_changed.connect(self.document_changed)
         self.renderer.file_changed.connect(self.file_modified)
+        self.renderer.open_progress.connect(self.open_progress)
+        self.renderer.open_finished.connect(self.open_finished)
+        self.renderer.geometry_completed.connect(self.geometry_completed)
+        self.warn_on_open = True
 
         self.changes_tracker = ChangesTracker()
         self.changes_tracker.dirty.connect(self.dirtiness_has_changed)
@@ -411,7 +414,7 @@ class SwikWidget(Shell):
         if len(selected) == 0:
             return
         selected = selected[0]
-        page = self.view.pages[selected.item.page]
+        page = self.view.get_page_item(selected.item.page)
         if self.view.get_mode() == SwikGraphView.MODE_SINGLE_PAGE:
             self.view.move_to_page(page.index)
         p = page.mapToScene(selected.item.to)
@@ -474,6 +477,13 @@ class SwikWidget(Shell):
         return self.interaction_enabled
 
     def preferences_changed(self):
+        self.renderer.set_cache_budget(self.config.get_cache_size())
+        self.renderer.set_render_backend(self.config.get_render_backend())
+        self.renderer.set_progressive(self.config.get_progressive())
+        self.renderer.set_thumbnail_cache(self.config.get_thumbnail_cache())
+        self.renderer.set_layered(self.config.get_layered())
+        self.renderer.set_low_memory(self.config.get_low_memory())
+        self.renderer.set_metrics_log(self.config.get_metrics_log())
         self.update_lateral_bar_position()
         self.update_miniature_bar_position()
 
@@ -540,39 +550,15 @@ class SwikWidget(Shell):
         # Force splitter adjustment
         QApplication.processEvents()
 
-        self.load_progress_action.setVisible(True)
-        self.load_progress.setMaximum(self.renderer.get_num_of_pages())
-
-        # Create pages
-        self.view.set_mode2(mode, ratio)
-
-        self.view.reset()
-        self.miniature_view.reset()
-
-        for i in range(self.renderer.get_num_of_pages()):
-            # Create Page
-            page = self.view.create_page(i, self.view.get_ratio())
-            self.view.apply_layout(page)
-
-            # Create Miniature Page
-            mini_page = self.miniature_view.create_page(i, 1)
-            self.miniature_view.apply_layout(mini_page)
-
-            # Update progress bar
-            self.load_progress.setValue(i + 1)
-
-            # Process events every 20 pages
-            # to avoid freezing the interface
-            if i % 20 == 0:
-                QApplication.processEvents()
+        # Layout of the pages, only those around
+        # the restored position are created
+        self.view.set_mode2(mode, ratio, scroll)
+        self.miniature_view.fully_update_layout()
 
-        self.load_progress_action.setVisible(False)
         self.mode_group.reset()
         self.update_toc()
 
-        pdf_widgets = [item for item in self.view.scene().items() if isinstance(item, PdfWidget)]
-
-        if len(pdf_widgets) > 0:
+        if self.renderer.has_widgets():
             self.tool_form_btn.click()
 
         # Important otherwise the
@@ -672,36 +658,60 @@ class SwikWidget(Shell):
                 return
 
             self.mode_group.reset()
-            res = self.renderer.open_pdf(filename)
-            if res == MuPDFRenderer.OPEN_REQUIRES_PASSWORD:
-                dialog = PasswordDialog(False, parent=self)
-                if dialog.exec() == QDialog.Accepted:
-                    res = self.renderer.open_pdf(filename, dialog.getText())
-
-            if res == MuPDFRenderer.OPEN_OK:
-                self.set_interactable(True)
-                self.file_changed.emit(self)
-                # To update the number of page
-                self.view.page_scrolled()
-                self.config.update_recent(self.renderer.get_filename())
-                self.config.flush()
-                self.file_browser.select(self.renderer.get_filename(), False)
+            self.warn_on_open = warn
+            self.renderer.open_pdf_async(filename)
 
-            else:
-                warn and QMessageBox.warning(self, "Error", "Error opening file")
-                self.close_requested.emit(self)
+    def open_progress(self, done, total):
+        self.load_progress.setMaximum(total)
+        self.load_progress.setValue(done)
+        self.load_progress_action.setVisible(True)
+
+    def open_finished(self, res):
+        # The progress is that of the geometry, see geometry_completed
+        self.load_progress_action.setVisible(self.renderer.is_measuring())
 
-    def save_file(self, name=None):
+        if res == MuPDFRenderer.OPEN_REQUIRES_PASSWORD:
+            dialog = PasswordDialog(False, parent=self)
+            if dialog.exec() == QDialog.Accepted:
+                self.renderer.open_pdf_async(self.renderer.get_filename(), dialog.getText())
+                return
+
+        if res == MuPDFRenderer.OPEN_OK:
+            # Pages can't be edited until their sizes are known
+            self.set_interactable(not self.renderer.is_measuring())
+            self.file_changed.emit(self)
+            # To update the number of page
+            self.view.page_scrolled()
+            self.config.update_recent(self.renderer.get_filename())
+            self.config.flush()
+            self.file_browser.select(self.renderer.get_filename(), False)
+
+        else:
+            self.warn_on_open and QMessageBox.warning(self, "Error", "Error opening file")
+            self.close_requested.emit(self)
+
+    def geometry_completed(self):
+        # The document was shown with the size of
+        # its first page for all, see DocumentLoader
+        self.load_progress_action.setVisible(False)
+        self.view.update_page_sizes()
+        self.miniature_view.update_page_sizes()
+        self.set_interactable(True)
+
+    def save_file(self, name=None, full=False):
         name = self.renderer.get_filename() if name is None else name
         print("in save_file: ", name)
 
+        # Incremental unless the pages were rearranged
+        full = full or self.changes_tracker.needs_full_save()
+
         if self.renderer.get_num_of_pages() > 100:
             self.placeholder = Progressing(self, title="Saving PDF...")
             self.placeholder.show()
-            result = self.renderer.save_pdf(name, False)
+            result = self.renderer.save_pdf(name, False, full)
             self.placeholder.close()
         else:
-            result = self.renderer.save_pdf(name, False)
+            result = self.renderer.save_pdf(name, False, full)
 
         if result:
             self.file_browser.select(self.renderer.get_filename(), False)
@@ -709,7 +719,8 @@ class SwikWidget(Shell):
             self.changes_tracker.clear()
             self.mode_group.reset()
 
-            # Update miniature page view (not especially efficient)
+            # Update miniature page view, the thumbnails of the
+            # pages that did not change come from the disk cache
             for page in self.miniature_view.pages.values():
                 page.invalidate()
 
@@ -759,14 +770,9 @@ class SwikWidget(Shell):
             index = self.renderer.get_num_of_pages()
             num_of_pages_added = self.renderer.append_pdf(filename)
 
+            # The pages are created when shown
             for i in range(num_of_pages_added):
-                page = self.view.create_page(index + i, self.view.get_ratio())
-                page.update_original_info({"page": i, "append_id": append_id})
-                self.view.apply_layout(page)
-
-                page = self.miniature_view.create_page(index + i, self.miniature_view.get_ratio())
-                self.miniature_view.apply_layout(page)
-
+                self.view.update_original_info(index + i, {"page": i, "append_id": append_id})
                 pd.set_progress(i * 100 / num_of_pages_added)
 
             pd.set_progress(100)
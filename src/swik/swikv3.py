@@ -50,6 +50,7 @@ class MainWindow(QMainWindow):
         open_recent.aboutToShow.connect(lambda: self.config.fill_recent(self, open_recent))
         save = file_menu.addAction('Save', self.save_file)
         save_as = file_menu.addAction('Save as', self.save_file_as)
+        save_optimized = file_menu.addAction('Save optimized', self.save_file_optimized)
 
         rename = file_menu.addAction('Rename', self.rename)
         file_menu.addSeparator()
@@ -59,7 +60,7 @@ class MainWindow(QMainWindow):
         file_menu.addSeparator()
         open_wo_odf = file_menu.addMenu('Open with other Viewer')
 
-        self.file_menu_actions = [save, save_as, copy_path, rename, open_wo_odf]
+        self.file_menu_actions = [save, save_as, save_optimized, copy_path, rename, open_wo_odf]
 
         def update_open_with_other():
             open_wo_odf.clear()
@@ -314,6 +315,9 @@ class MainWindow(QMainWindow):
     def save_file_as(self):
         self.current().save_file_as()
 
+    def save_file_optimized(self):
+        self.current().save_file(full=True)
+
     def rename(self):
         self.current().rename()
 
@@ -18,6 +18,12 @@ class SyncDict(dict):
         self.lock.release()
         return res
 
+    def pop(self, key, default=None):
+        self.lock.acquire()
+        res = super().pop(key, default)
+        self.lock.release()
+        return res
+
     def __setitem__(self, key, value):
         self.lock.acquire()
         super().__setitem__(key, value)
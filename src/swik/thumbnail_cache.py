@@ -0,0 +1,93 @@
+import os
+import threading
+
+from PyQt5.QtGui import QImage
+
+
+class ThumbnailCache:
+    # Thumbnails of the miniature view, stored compressed on disk so
+    # that reopening a document does not render them again. They are
+    # stored by document fingerprint and page content hash: after an
+    # edit (or a save) only the pages whose content changed miss.
+    # When the files exceed MAX_SIZE the least recently used (by
+    # mtime, touched when loaded) are removed down to PRUNED_SIZE
+
+    QUALITY = 85
+    MAX_SIZE = 256 * 1024 * 1024
+    PRUNED_SIZE = 192 * 1024 * 1024
+
+    def __init__(self, base_dir=None):
+        self.base_dir = base_dir if base_dir is not None else os.path.join(
+            os.path.expanduser('~'), '.cache', 'swik', 'thumbnails')
+        # Saved from the render threads, measured on the first save
+        self.lock = threading.Lock()
+        self.size = None
+
+    def get_path(self, fingerprint, page_hash):
+        return os.path.join(self.base_dir, fingerprint, page_hash + ".jpg")
+
+    def load(self, fingerprint, page_hash):
+        path = self.get_path(fingerprint, page_hash)
+        if not os.path.exists(path):
+            return None
+        # As stored: 8 bits per pixel for the pages without color
+        image = QImage(path)
+        if image.isNull():
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return image
+
+    def save(self, fingerprint, page_hash, image):
+        path = self.get_path(fingerprint, page_hash)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written aside and renamed, never half a file
+            temp = path + ".tmp"
+            if image.save(temp, "JPG", self.QUALITY):
+                os.replace(temp, path)
+                self.stored(os.path.getsize(path))
+        except OSError:
+            pass
+
+    def get_files(self):
+        # As (mtime, size, path)
+        files = []
+        for root, _, names in os.walk(self.base_dir):
+            for name in names:
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                    files.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+                except OSError:
+                    pass
+        return files
+
+    def stored(self, size):
+        with self.lock:
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self.get_files())
+            else:
+                self.size += size
+            if self.size > self.MAX_SIZE:
+                self.prune()
+
+    def prune(self):
+        files = sorted(self.get_files())
+        self.size = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if self.size <= self.PRUNED_SIZE:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+            except OSError:
+                pass
+
+        # The folders of the documents left without thumbnails
+        for name in os.listdir(self.base_dir):
+            try:
+                os.rmdir(os.path.join(self.base_dir, name))
+            except OSError:
+                pass
@@ -90,7 +90,7 @@ class ToolCrop(Tool, Undoable):
         self.update_cropped()
 
         self.crop_page_cb = QComboBox()
-        self.crop_page_cb.addItems(["All"] + [str(i + 1) for i in range(len(self.view.pages))])
+        self.crop_page_cb.addItems(["All"] + [str(i + 1) for i in range(self.view.get_num_of_pages())])
 
         self.vlayout.addWidget(utils.framed(self.draw_btn, "Crop"))
         label = QLabel("☼")
@@ -109,15 +109,18 @@ class ToolCrop(Tool, Undoable):
             return
 
         for page in self.view.pages.values():
+            area = QRectF()
             for item in page.items(CropRectItem):
-                self.renderer.add_redact_annot(page.index, QRectF(0, 0, item.pos().x() - 1, page.rect().height()))
-                self.renderer.add_redact_annot(page.index, QRectF(0, 0, page.rect().width(), item.pos().y() - 1))
-                self.renderer.add_redact_annot(page.index, QRectF(item.pos().x() + item.rect().width(), 0,
+                area |= self.renderer.add_redact_annot(page.index, QRectF(0, 0, item.pos().x() - 1, page.rect().height()))
+                area |= self.renderer.add_redact_annot(page.index, QRectF(0, 0, page.rect().width(), item.pos().y() - 1))
+                area |= self.renderer.add_redact_annot(page.index, QRectF(item.pos().x() + item.rect().width(), 0,
                                                                   page.rect().width() - item.pos().x() - item.rect().width(),
                                                                   page.rect().height()))
-                self.renderer.add_redact_annot(page.index, QRectF(0, item.pos().y() + item.rect().height(), page.rect().width(),
+                area |= self.renderer.add_redact_annot(page.index, QRectF(0, item.pos().y() + item.rect().height(), page.rect().width(),
                                                                   page.rect().height() - item.pos().y() - item.rect().height()))
-            page.invalidate()
+            # Pages without crop rect have not changed
+            if not area.isNull():
+                page.invalidate(area)
 
     def draw(self):
         self.rubberband = CropRectItem(None, pen=Qt.transparent, brush=QColor(0, 0, 0, 80))
@@ -127,7 +130,7 @@ class ToolCrop(Tool, Undoable):
 
     def update_cropped(self):
         self.cropped_cb.clear()
-        for index in self.view.pages:
+        for index in range(self.view.get_num_of_pages()):
             if self.renderer.is_cropped(index):
                 self.cropped_cb.addItem(str(index + 1))
         self.uncrop_btn.setEnabled(self.cropped_cb.count() > 0)
@@ -213,9 +216,9 @@ class ToolCrop(Tool, Undoable):
 
         text = self.crop_page_cb.currentText()
         if text == "All":
-            pages = self.view.pages.values()
+            pages = [self.view.get_page_item(i) for i in range(self.view.get_num_of_pages())]
         else:
-            pages = [self.view.pages[int(text) - 1]]
+            pages = [self.view.get_page_item(int(text) - 1)]
 
         for page in pages:
 
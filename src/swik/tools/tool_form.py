@@ -1,4 +1,4 @@
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QRectF
 from PyQt5.QtGui import QKeySequence
 from PyQt5.QtWidgets import QVBoxLayout, QWidget, QPushButton, QApplication, QShortcut
 
@@ -41,6 +41,11 @@ class ToolForm(Tool):
         self.widget.flatten()
 
     def clear_fields(self):
+        # Also those of the pages not shown yet
+        for index in self.renderer.get_fields_index():
+            if (page := self.view.get_page_item(index)) is not None:
+                page.read_items()
+
         widgets = [item for item in self.view.items() if isinstance(item, PdfWidget)]
         for widget in widgets:
             widget.clear()
@@ -52,17 +57,21 @@ class ToolForm(Tool):
         QApplication.processEvents()
 
         widgets = [item for item in self.view.items() if isinstance(item, PdfWidget)]
-        pages_to_invalidate = set()
+        pages_to_invalidate = {}
 
         if self.preview_btn.isChecked():
             for widget in widgets:
-                self.renderer.add_widget(widget.parentItem().index, widget)
-                pages_to_invalidate.add(widget.parentItem().index)
+                index = widget.parentItem().index
+                area = self.renderer.add_widget(index, widget)
+                if area is not None:
+                    pages_to_invalidate[index] = pages_to_invalidate.get(index, QRectF()).united(area)
                 widget.setVisible(False)
 
-            for index in pages_to_invalidate:
-                self.view.pages[index].invalidate()
-                self.widget.miniature_view.pages[index].invalidate()
+            # The images are shared, the miniatures only need a repaint
+            for index, area in pages_to_invalidate.items():
+                self.view.pages[index].invalidate(area)
+                if (miniature := self.widget.miniature_view.pages.get(index)) is not None:
+                    miniature.update()
 
         else:
             for widget in widgets:
@@ -246,7 +246,7 @@ class ToolInsertSignatureImage(Tool):
                 patch.setRect(QRectF(0, 0, rect.width() + 2, rect.height() + 2))
                 patch.setPos(x - 1, y - 1)
 
-                item = InsertImageRectItem(self.view.pages[0], pen=Qt.transparent, brush=Qt.transparent, image=image, image_mode=self.image_mode)
+                item = InsertImageRectItem(self.view.get_page_item(0), pen=Qt.transparent, brush=Qt.transparent, image=image, image_mode=self.image_mode)
                 item.setRect(rect)
                 item.setPos(x, y)
                 item.setZValue(100)
@@ -262,11 +262,11 @@ class ToolInsertSignatureImage(Tool):
     def raise_images(self):
         images = self.renderer.get_images(0)
         for image, x, y, rect in images:
-            patch = Patch(self.view.pages[0])
+            patch = Patch(self.view.get_page_item(0))
             patch.setRect(rect)
             patch.setPos(x, y)
 
-            item = InsertImageRectItem(self.view.pages[0], pen=Qt.transparent, brush=Qt.transparent, image=image, image_mode=self.image_mode)
+            item = InsertImageRectItem(self.view.get_page_item(0), pen=Qt.transparent, brush=Qt.transparent, image=image, image_mode=self.image_mode)
             item.setRect(rect)
             item.setPos(x, y)
             item.setZValue(100)
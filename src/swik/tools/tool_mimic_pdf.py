@@ -121,7 +121,7 @@ class ToolMimicPDF(Tool):
 
         def apply():
             self.renderer.sync_requested.emit()
-            self.view.pages[0].invalidate()
+            self.view.get_page_item(0).invalidate()
             filename = self.renderer.get_filename().replace(".pdf", "-mimic.pdf")
             self.renderer.save_elsewhere(filename)
             self.widget.open_requested.emit(filename, self.view.page, self.view.get_ratio())
@@ -147,7 +147,7 @@ class ToolMimicPDF(Tool):
                     if not self.placeholder.set_progress(i):
                         break
                     spans = self.renderer.extract_spans(i)
-                    page = self.view.pages[i]
+                    page = self.view.get_page_item(i)
                     for span in spans:
                         a = QGraphicsRectItem(span.rect, page)
                         a.setToolTip(span.font)
@@ -186,7 +186,7 @@ class ToolMimicPDF(Tool):
             for i in range(0, self.view.get_page_count()):
                 if not self.progressing.set_progress(i):
                     break
-                page: Page = self.view.pages[i]
+                page: Page = self.view.get_page_item(i)
 
                 items = page.items(SwikTextReplace)
                 for item in items:
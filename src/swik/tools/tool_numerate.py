@@ -53,7 +53,7 @@ class ToolNumerate(BasicTool):
                     else:
                         num = utils.int_to_roman(start + j).lower()
 
-                    number = SwikTextNumerate(text.replace("$i", num), self.view.pages[i], self.font_manager, Arial(), 12)
+                    number = SwikTextNumerate(text.replace("$i", num), self.view.get_page_item(i), self.font_manager, Arial(), 12)
                     number.set_hover_color(utils.get_color(self.view.scene().get_bunches_count(), 1))
                     bunch.add(number)
 
@@ -70,14 +70,23 @@ class ToolRearrange(Tool, Undoable):
 
         self.widget.set_app_widget(self.helper, 150, title="Rearrange")
 
-        for page in self.view.pages.values():
-            page.update_original_info({"append_id": self.append_id})
+        for index in range(self.view.get_num_of_pages()):
+            self.view.update_original_info(index, {"append_id": self.append_id})
+        self.view.page_created.connect(self.page_created)
 
     def show_numbers(self):
         for page in self.view.pages.values():
-            info = page.get_original_info()
-            page.set_visual_info("{}".format(info.get("page", "")), utils.get_color(info.get("append_id", 0)))
-            page.show_visual_info(self.show_numbers_btn.isChecked())
+            self.show_info(page)
+
+    def show_info(self, page):
+        info = page.get_original_info()
+        page.set_visual_info("{}".format(info.get("page", "")), utils.get_color(info.get("append_id", 0)))
+        page.show_visual_info(self.show_numbers_btn.isChecked())
+
+    def page_created(self, page):
+        # Pages that were not items when the info was shown
+        if self.show_numbers_btn.isChecked():
+            self.show_info(page)
 
     def append_pdf(self):
 
@@ -92,14 +101,9 @@ class ToolRearrange(Tool, Undoable):
             index = self.renderer.get_num_of_pages()
             num_of_pages_added = self.renderer.append_pdf(filename)
 
+            # The pages are created when shown
             for i in range(num_of_pages_added):
-                page = self.view.create_page(index + i, self.view.get_ratio())
-                page.update_original_info({"page": i, "append_id": self.append_id})
-                self.view.layout_manager.update_layout(page)
-
-                page = self.miniature_view.create_page(index + i, self.miniature_view.get_ratio())
-                self.miniature_view.layout_manager.update_layout(page)
-
+                self.view.update_original_info(index + i, {"page": i, "append_id": self.append_id})
                 pd.set_progress(i * 100 / num_of_pages_added)
 
             pd.set_progress(100)
@@ -316,7 +320,7 @@ class ToolRearrange(Tool, Undoable):
                 self.undo_order_change(kind, info)
 
         elif kind == Action.PAGES_ADDED:
-            whole = list(range(len(self.view.pages)))
+            whole = list(range(self.view.get_num_of_pages()))
             for index, w, h in reversed(info["pages_added"]):
                 whole.pop(index)
 
@@ -371,8 +375,7 @@ class ToolRearrange(Tool, Undoable):
     def undo_order_change(self, kind, info):
         order = info["indices"]
 
-        # !!! self.view.pages are the index of the pages !!!
-        zipped = list(zip(order, self.view.pages))
+        zipped = list(zip(order, range(self.view.get_num_of_pages())))
         zipped.sort(key=lambda x: x[0])
         _, new_order = zip(*zipped)
         self.rearrange(new_order)
@@ -396,12 +399,13 @@ class ToolRearrange(Tool, Undoable):
         for page in self.selected:
             page.setZValue(0)
 
+        self.view.page_created.disconnect(self.page_created)
         self.widget.remove_app_widget()
         self.helper.deleteLater()
 
     def action_duplicate(self, indices):
 
-        list_of_pages = list(range(len(self.view.pages)))
+        list_of_pages = list(range(self.view.get_num_of_pages()))
         for index in indices:
             where = list_of_pages.index(index)
             list_of_pages.insert(where, index)
@@ -418,7 +422,7 @@ class ToolRearrange(Tool, Undoable):
         if self.config.should_continue("ask_delete", "This operation is not undoable and will clear the undo stack.\nProceed?"):
 
             # Delete the selected pages
-            remaining = [i for i in range(len(self.view.pages)) if i not in deleting]
+            remaining = [i for i in range(self.view.get_num_of_pages()) if i not in deleting]
             self.renderer.rearrange_pages(remaining, False)
             for view in self.views:
                 view.rearrange(remaining)
@@ -471,8 +475,9 @@ class ToolRearrange(Tool, Undoable):
         for index in indices:
             self.renderer.rotate_page(index, angle)
             for view in self.views:
-                page = view.pages[index]
-                page.invalidate()
+                if (page := view.pages.get(index)) is not None:
+                    page.invalidate()
+                view.update_page_size(index)
         for view in self.views:
             view.update_layout()
 
@@ -0,0 +1,84 @@
+import os
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import pymupdf
+import pytest
+from PyQt5.QtWidgets import QApplication, QGraphicsScene
+
+from swik.graphview import GraphView
+from swik.renderer import MuPDFRenderer
+
+PAGES = 5
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture
+def view(app, tmp_path):
+    document = pymupdf.open()
+    for i in range(PAGES):
+        document.new_page(width=300 + 10 * i, height=400)
+    filename = str(tmp_path / "pages.pdf")
+    document.save(filename)
+
+    renderer = MuPDFRenderer()
+    renderer.open_pdf(filename)
+    scene = QGraphicsScene()
+    view = GraphView(None, renderer, scene)
+    view.resize(800, 600)
+    view.show()
+    view.fully_update_layout()
+    yield view
+    view.finish()
+    view.close()
+    scene.clear()
+
+
+def check_layout(view):
+    count = view.renderer.get_num_of_pages()
+    assert len(view.page_layout) == count
+    for index, page in view.pages.items():
+        assert page.index == index
+        assert page.pos() == view.page_layout.get_rect(index).topLeft()
+
+
+def test_duplicate_last_page(view):
+    order = list(range(PAGES)) + [PAGES - 1]
+    view.renderer.rearrange_pages(order, False)
+    view.move_to_page(PAGES - 1)
+    view.rearrange(order)
+
+    assert view.pages[PAGES].get_orig_size() == view.renderer.get_page_size(PAGES - 1)
+    check_layout(view)
+
+
+def test_insert_after_last_page(view):
+    view.move_to_page(PAGES - 1)
+    view.renderer.insert_blank_page(PAGES, 200, 200)
+    page = view.insert_page(PAGES)
+
+    assert page.index == PAGES
+    assert page.get_orig_size() == (200, 200)
+    check_layout(view)
+
+
+def test_insert_in_the_middle(view):
+    view.renderer.insert_blank_page(1, 200, 200)
+    page = view.insert_page(1)
+
+    assert page.get_orig_size() == (200, 200)
+    check_layout(view)
+
+
+def test_layout_after_insert(view):
+    layout = view.page_layout
+    last = layout.get_rect(PAGES - 1)
+    layout.insert(PAGES, (200, 200))
+
+    assert len(layout) == PAGES + 1
+    assert layout.get_rect(PAGES).top() > last.bottom()
+    assert PAGES in layout.get_pages_in_rect(layout.get_rect(PAGES))